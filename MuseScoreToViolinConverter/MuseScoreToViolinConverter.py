@@ -1,164 +1,513 @@
-﻿import xml.etree.ElementTree as ET
-from functools import lru_cache
-from music21 import converter, note, stream
+﻿# Tk front end of the converter: window, loading in the background, editing and autosave.
+# Reading scores, fingering and exports are in converter_core.py.
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 from tkinter.scrolledtext import ScrolledText
-import pandas as pd
-import zipfile
 import os
 import json
 import threading
+import queue
 import subprocess
 import re
-from bs4 import BeautifulSoup
-import pyperclip
+import bisect
+import sys
+import time
+import argparse
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import converter_core as core
+from converter_core import (MUSICXML_ENGINES, FINGERING_MODES, MEASURES_PER_BATCH, style_palette, NoteEvents,
+                            iter_measures, convert_measures, measure_batches,
+                            score_cache_key, load_cached_score, store_cached_score,
+                            fingering_runs, runs_to_record, record_to_runs, css_to_style, style_to_css,
+                            get_html_path, read_html_lines, html_line_fragment, html_document,
+                            get_sidecar_path, read_sidecar, sidecar_line_fragment, sidecar_document,
+                            write_atomically, set_musicxml_engine, set_fingering_mode, run_batch,
+                            INSTRUMENTS, set_instrument, fingering_alternatives, styled_fingering,
+                            list_parts, default_parts, convert_parts, reread_score, relabel_record)
 
 current_file_path = None
+current_parts = None  # parts of the opened file being converted, None for the whole file
+# The opened file once its load is complete and its saved edits shown: the only one autosaved.
+# A cancelled or failed load leaves part of the score in the Textboxes, it must not overwrite the saved edits.
+loaded_file_path = None
+
+current_load_job = None
+
+# Opt-in profiling of each load: None, 'cprofile' or 'tracemalloc' (--profile).
+# The report is written next to the score.
+PROFILERS = ('cprofile', 'tracemalloc')
+load_profiler = None
+
+# Counters of the Tk work, the load statistics keep the difference over a load
+tk_counters = {'tcl_calls': 0, 'tags': 0}
+
+# Timings (seconds per stage) and counters of one load, for the debug panel and the log line
+class LoadStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Fingering mode of the load, the combobox may change meanwhile
+        self.fingering = core.fingering_mode
+        self.timings = {}
+        self.counters = {}
+        self.tk_counters_start = dict(tk_counters)
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def count(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    # Time spent in the iterable itself (reading the file), not in the loop body
+    def timed_iter(self, stage, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def summary(self, file_path, status):
+        counters = dict(self.counters)
+        for counter, start in self.tk_counters_start.items():
+            counters[counter] = tk_counters[counter] - start
+        return {
+            'file': os.path.basename(file_path),
+            'status': status,
+            'engine': core.musicxml_engine,
+            'fingering': self.fingering,
+            'total': round(time.perf_counter() - self.start, 4),
+            'timings': {stage: round(seconds, 4) for stage, seconds in self.timings.items()},
+            'counters': counters,
+        }
+
+# A file being read and converted by the worker thread, with the instrument and fingering mode
+# chosen when it started
+class LoadJob:
+    def __init__(self, file_path, parts=None):
+        self.file_path = file_path
+        self.parts = parts
+        self.instrument = core.current_instrument()
+        self.mode = core.fingering_mode
+        self.phrase_measures = core.OPTIMIZER_PHRASE_MEASURES
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.measure_count = 0
+        self.stats = LoadStats()
+
+# Worker thread: parse the file and compute the fingering, the Tk widgets are only touched by poll_load_job
+def load_worker(job):
+    profiler = cProfile.Profile() if load_profiler == 'cprofile' else None
+    if profiler:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another load is still being profiled
+            profiler = None
+    stats = job.stats
+    try:
+        with stats.timer('cache_key'):
+            cache_key = score_cache_key(job.file_path, mode=job.mode, parts=job.parts,
+                                        phrase_measures=job.phrase_measures, instrument=job.instrument)
+        with stats.timer('cache_read'):
+            cached = load_cached_score(cache_key)
+        stats.count('cache_hit', 1 if cached else 0)
+        if cached:
+            # Already converted: no parsing, everything is sent at once
+            stats.count('measures', cached[0].measure_count())
+            stats.count('notes', len(cached[0]))
+            job.results.put(('measures', cached))
+        elif job.parts is not None and len(job.parts) > 1:
+            # Several parts: each one is read and converted by a worker process
+            measures, fingerings = NoteEvents(), []
+            with stats.timer('parts'):
+                for part_measures, part_fingerings in convert_parts(job.file_path, job.parts, mode=job.mode,
+                                                                    phrase_measures=job.phrase_measures,
+                                                                    executor=get_part_executor(),
+                                                                    instrument=job.instrument):
+                    if job.cancelled.is_set():
+                        return
+                    stats.count('measures', part_measures.measure_count())
+                    stats.count('notes', len(part_measures))
+                    measures.extend(part_measures)
+                    fingerings.extend(part_fingerings)
+                    job.results.put(('measures', (part_measures, part_fingerings)))
+            if measures.measure_count():
+                with stats.timer('cache_write'):
+                    store_cached_score(cache_key, measures, fingerings)
+        else:
+            measures, fingerings = NoteEvents(), []
+            batches = measure_batches(iter_measures(job.file_path, parts=job.parts), job.mode, job.phrase_measures)
+            for batch in stats.timed_iter('parse', batches):
+                if job.cancelled.is_set():
+                    return
+                with stats.timer('convert'):
+                    batch_fingerings = convert_measures(batch, job.mode, job.instrument)
+                stats.count('measures', batch.measure_count())
+                stats.count('notes', len(batch))
+                measures.extend(batch)
+                fingerings.extend(batch_fingerings)
+                job.results.put(('measures', (batch, batch_fingerings)))
+            if measures.measure_count():
+                with stats.timer('cache_write'):
+                    store_cached_score(cache_key, measures, fingerings)
+
+        # Existing user's fingering for these parts: the sidecar file, or the HTML export of older versions
+        sidecar_path = get_sidecar_path(job.file_path, job.parts)
+        html_path = get_html_path(job.file_path, job.parts)
+        with stats.timer('saved_edits_read'):
+            if os.path.exists(sidecar_path):
+                # Edits saved for other parts under the same name (older versions) are neither shown nor overwritten
+                sidecar = read_sidecar(sidecar_path, job.parts)
+                saved_edits = ('sidecar', sidecar) if sidecar else ('other_parts', sidecar_path)
+            elif os.path.exists(html_path):
+                saved_edits = ('html', read_html_lines(html_path))
+            else:
+                saved_edits = None
+        job.results.put(('done', saved_edits))
+    except Exception as e:
+        job.results.put(('error', e))
+    finally:
+        if profiler:
+            profiler.disable()
+            write_profile_report(job.file_path, 'profile', lambda f: pstats.Stats(profiler, stream=f)
+                                 .sort_stats('cumulative').print_stats(40))
+
+# Worker processes converting the parts of a score, started on the first score with several parts
+part_executor = None
+
+def get_part_executor():
+    global part_executor
+    if part_executor is None:
+        part_executor = ProcessPoolExecutor()
+    return part_executor
+
+# Path of a profiling report next to the score
+def get_profile_path(file_path, kind):
+    directory = os.path.dirname(file_path)
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(directory, f"{base_name}_{kind}.txt")
+
+def write_profile_report(file_path, kind, write):
+    try:
+        with open(get_profile_path(file_path, kind), 'w', encoding='utf-8') as f:
+            write(f)
+    except OSError as e:
+        print(f"Error writing the {kind} report: {e}")
+
+def write_tracemalloc_report(f):
+    current, peak = tracemalloc.get_traced_memory()
+    f.write(f"Current: {current / 2**20:.1f} MB, peak: {peak / 2**20:.1f} MB\n\n")
+    for statistic in tracemalloc.take_snapshot().statistics('lineno')[:40]:
+        f.write(f"{statistic}\n")
+
+# End of a load: structured log line, debug panel, and the tracemalloc report if enabled
+last_load_summary = None
+
+def finish_load_stats(job, status):
+    global last_load_summary
+    last_load_summary = job.stats.summary(job.file_path, status)
+    print(f"load {json.dumps(last_load_summary)}")
+    update_debug_panel()
+    if load_profiler == 'tracemalloc' and tracemalloc.is_tracing():
+        write_profile_report(job.file_path, 'tracemalloc', write_tracemalloc_report)
+        tracemalloc.stop()
 
 # Function to load a MusicXML, MSCX, or MSCZ file
 def load_musicxml():
-    global current_file_path
-    file_path = filedialog.askopenfilename(filetypes=[("All MusicXML, MSCX, and MSCZ files", "*.musicxml;*.mscx;*.mscz")])
+    file_path = filedialog.askopenfilename(filetypes=[("All MusicXML, MSCX, and MSCZ files", "*.musicxml;*.mxl;*.mscx;*.mscz")])
     if file_path:
-        current_file_path = file_path
-        
-        # Check for existing HTML file
-        directory = os.path.dirname(file_path)
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        html_path = os.path.join(directory, f"{base_name}_fingering.html")
-        
+        # Scores with several parts: only the chosen ones are read
+        parts = None
         try:
-            # Process the file based on its extension
-            if file_path.endswith('.mscz'):
-                # Create a temporary directory for extraction
-                import tempfile
-                temp_dir = tempfile.mkdtemp()
-                
-                try:
-                    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                        # List all files in the archive
-                        mscx_files = [f for f in zip_ref.namelist() if f.endswith('.mscx')]
-                        
-                        if not mscx_files:
-                            raise Exception("No .mscx file found in the .mscz archive")
-                        
-                        # Extract the first .mscx file found
-                        mscx_path = os.path.join(temp_dir, mscx_files[0])
-                        zip_ref.extract(mscx_files[0], temp_dir)
-                        
-                        # Parse the extracted .mscx file
-                        score = parse_mscx(mscx_path)
-                        if score:
-                            display_measures(score, is_mscx=True)
-                        else:
-                            messagebox.showerror("Error", "No measures found in the MSCX file")
-                finally:
-                    # Clean up temporary directory
-                    import shutil
-                    shutil.rmtree(temp_dir)
-                    
-            elif file_path.endswith('.mscx'):
-                score = parse_mscx(file_path)
-                if score:
-                    display_measures(score, is_mscx=True)
-                else:
-                    messagebox.showerror("Error", "No measures found in the MSCX file")
-            else:
-                # Handle MusicXML files
-                score = converter.parse(file_path)
-                display_measures(score, is_mscx=False)
-
-            file_label.config(text=f"File opened: {os.path.basename(file_path)}")
-            
-            # Convert notes to violin fingering
-            convert_to_violin()
-            
-            # Load existing HTML file if it exists
-            if os.path.exists(html_path):
-                with open(html_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    soup = BeautifulSoup(content, 'html.parser')
-                    body_content = soup.find('body')
-                    
-                    if body_content:
-                        editable_notes_display.delete('1.0', tk.END)
-                        for line in body_content.find_all('div', class_='measure'):
-                            for element in line:
-                                if element.name == 'span':
-                                    text = element.get_text()
-                                    classes = element.get('class', [])
-                                    tag = ' '.join(classes)
-                                    editable_notes_display.insert(tk.END, text, tag)
-                                else:
-                                    editable_notes_display.insert(tk.END, element)
-                            editable_notes_display.insert(tk.END, '\n')
-            
+            all_parts = list_parts(file_path)
         except Exception as e:
-            messagebox.showerror("Error", f"Error loading file: {str(e)}")
-            print(f"Error details: {e}")
- 
-# Function to parse an MSCX file and extract musical information
-def parse_mscx(file_path):
-    try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        measures = []
-        for measure in root.findall(".//Measure"):
-            measure_notes = []
-            for chord in measure.findall(".//Chord"):
-                for note_elem in chord.findall(".//Note"):
-                    pitch_elem = note_elem.find(".//pitch")
-                    if pitch_elem is not None and pitch_elem.text is not None:
-                        try:
-                            midi_number = int(pitch_elem.text)
-                            note_name = midi_to_note_name(midi_number)
-                            measure_notes.append(note_name)
-                        except ValueError:
-                            measure_notes.append("?")
-                            measure_notes.append(pitch_elem.text)
-            if measure_notes:
-                measures.append(measure_notes)
-        if not measures:
-            print("No notes found in the MSCX file.")
-        return measures  # Return measures as a list for an MSCX file
-    except ET.ParseError as e:
-        print(f"Error parsing MSCX file: {e}")
-        return []
+            # The loading reports the error
+            print(f"Error listing the parts: {e}")
+            all_parts = []
+        if len(all_parts) > 1:
+            parts = choose_parts(all_parts)
+            if parts is None:
+                return
+        open_score(file_path, parts)
+
+# Start loading a score (the given parts only): the worker thread reads and converts it,
+# poll_load_job renders its batches. Returns the LoadJob.
+def open_score(file_path, parts=None):
+    global current_file_path, current_parts, current_load_job, loaded_file_path, score_settings
+    # Opening another file aborts the one still loading, pending edits are saved first
+    flush_autosave()
+    cancel_load()
+    loaded_file_path = None
+    current_file_path = file_path
+    current_parts = parts
+    start_watching(file_path)
+
+    # Clear previous content
+    reset_score_model()
+
+    if load_profiler == 'tracemalloc' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    job = LoadJob(file_path, parts)
+    current_load_job = job
+    score_settings = (job.instrument, job.mode, job.phrase_measures)
+    show_load_progress(True)
+    threading.Thread(target=load_worker, args=(job,), daemon=True).start()
+    root.after(50, poll_load_job, job)
+    return job
+
+# Ask which parts of the score to convert, the violin parts are checked. None if cancelled.
+def choose_parts(parts):
+    dialog = tk.Toplevel(root)
+    dialog.title("Parts to convert")
+    dialog.transient(root)
+    tk.Label(dialog, text="Parts to convert:").pack(anchor='w', padx=10, pady=5)
+    checked = default_parts(parts)
+    part_vars = []
+    for part in parts:
+        part_var = tk.BooleanVar(value=any(part is other for other in checked))
+        tk.Checkbutton(dialog, text=part['name'], variable=part_var).pack(anchor='w', padx=20)
+        part_vars.append(part_var)
+
+    chosen = []
+    def accept():
+        chosen.extend(part for part, part_var in zip(parts, part_vars) if part_var.get())
+        dialog.destroy()
+    buttons = tk.Frame(dialog)
+    buttons.pack(pady=10)
+    tk.Button(buttons, text="OK", width=10, command=accept).pack(side=tk.LEFT, padx=5)
+    tk.Button(buttons, text="Cancel", width=10, command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    dialog.grab_set()
+    dialog.wait_window()
+    return chosen or None
+
+# Render the results of the worker thread by batches of measures
+def poll_load_job(job):
+    global current_load_job, loaded_file_path
+    if job is not current_load_job:
+        return
+
+    if job.cancelled.is_set():
+        current_load_job = None
+        show_load_progress(False)
+        file_label.config(text=f"Loading cancelled: {os.path.basename(job.file_path)}")
+        finish_load_stats(job, 'cancelled')
+        return
+
+    measures, fingerings = NoteEvents(), []
+    while measures.measure_count() < MEASURES_PER_BATCH:
+        try:
+            kind, value = job.results.get_nowait()
+        except queue.Empty:
+            break
+
+        if kind == 'measures':
+            measures.extend(value[0])
+            fingerings.extend(value[1])
+            continue
+
+        # Last measures before the end of the job
+        with job.stats.timer('render'):
+            add_measures(measures, fingerings)
+        job.measure_count += measures.measure_count()
+        measures, fingerings = NoteEvents(), []
+
+        current_load_job = None
+        show_load_progress(False)
+        status = 'ok'
+        if kind == 'error':
+            status = 'error'
+            file_label.config(text=f"Error loading: {os.path.basename(job.file_path)}")
+            messagebox.showerror("Error", f"Error loading file: {str(value)}")
+            print(f"Error details: {value}")
+        elif job.measure_count == 0:
+            status = 'empty'
+            file_label.config(text="No file opened")
+            messagebox.showerror("Error", "No measures found in the file")
+        else:
+            file_label.config(text=f"File opened: {os.path.basename(job.file_path)}")
+            # Load the user's fingering if it exists
+            other_parts = value is not None and value[0] == 'other_parts'
+            if other_parts:
+                file_label.config(text=f"Not saved: {os.path.basename(value[1])} holds the edits of other parts")
+            elif value is not None:
+                kind, saved_edits = value
+                with job.stats.timer('saved_edits_show'):
+                    if kind == 'sidecar':
+                        show_sidecar_lines(*saved_edits)
+                    elif saved_edits is not None:
+                        show_html_lines(*saved_edits)
+            reset_autosave()
+            if not other_parts:
+                loaded_file_path = job.file_path
+            # Instrument or fingering mode changed during the load
+            if score_settings != core.conversion_settings():
+                convert_to_violin()
+        finish_load_stats(job, status)
+        return
+
+    with job.stats.timer('render'):
+        add_measures(measures, fingerings)
+    job.measure_count += measures.measure_count()
+    job.stats.count('render_batches')
+    file_label.config(text=f"Loading {os.path.basename(job.file_path)}: {job.measure_count} measures")
+    update_debug_panel(job.stats.summary(job.file_path, 'loading'))
+    root.after(10 if measures.measure_count() else 50, poll_load_job, job)
+
+# Cancel the file being loaded, if any
+def cancel_load():
+    if current_load_job is not None:
+        current_load_job.cancelled.set()
+
+# Show or hide the progress bar and the cancel button
+def show_load_progress(loading):
+    if loading:
+        progress_bar.place(x=250, y=17)
+        progress_bar.start(10)
+        cancel_button.place(x=410, y=13)
+    else:
+        progress_bar.stop()
+        progress_bar.place_forget()
+        cancel_button.place_forget()
+
+# Debug panel (F12): timings and counters of the load in progress or of the last one
+debug_window = None
+debug_label = None
+
+def toggle_debug_panel():
+    global debug_window, debug_label
+    if debug_window is not None:
+        debug_window.destroy()
+        debug_window = None
+        return
+    debug_window = tk.Toplevel(root)
+    debug_window.title("Load statistics")
+    debug_window.protocol("WM_DELETE_WINDOW", toggle_debug_panel)
+    debug_label = tk.Label(debug_window, font=('Courier', 10), justify=tk.LEFT, anchor='nw', padx=10, pady=10)
+    debug_label.pack(fill=tk.BOTH, expand=True)
+    update_debug_panel()
+
+def update_debug_panel(summary=None):
+    if debug_window is None:
+        return
+    summary = summary or last_load_summary
+    if summary is None:
+        debug_label.config(text="No file loaded yet")
+        return
+    lines = [f"{summary['file']} ({summary['status']})",
+             f"engine: {summary['engine']}, fingering: {summary['fingering']}",
+             f"{'total':20s} {summary['total']:9.4f}s", ""]
+    lines += [f"{stage:20s} {seconds:9.4f}s" for stage, seconds in summary['timings'].items()]
+    lines.append("")
+    lines += [f"{counter:20s} {value:9d}" for counter, value in summary['counters'].items()]
+    debug_label.config(text="\n".join(lines))
+
+# Replace the editable Textbox with the content of an exported HTML file
+def show_html_lines(lines, class_styles):
+    # The export ends with the empty line following the last newline
+    if lines and not lines[-1]:
+        lines = lines[:-1]
+    set_editable_lines([runs_to_record([(text, html_class_tags(classes, class_styles)) for text, classes in runs])
+                        for runs in lines])
+
+# Replace the editable Textbox with the content of a sidecar file
+def show_sidecar_lines(lines, styles):
+    # Like the export, the file ends with the empty line following the last newline
+    if lines and not lines[-1][0]:
+        lines = lines[:-1]
+    for tag, style in styles.items():
+        if tag not in style_palette:
+            add_palette_tag(tag, style)
+    set_editable_lines(lines)
+
+# Word offsets of each Textbox line, for the words after the "M001:" label:
+# {widget: {line: (starts, ends)}}. Filled when lines are rendered, on demand otherwise,
+# and dropped for the lines that are edited.
+WORD_PATTERN = re.compile(r'\S+')
+word_indexes = {}
+word_index_line_counts = {}
+highlighted_ranges = []
+
+# Function to get the (starts, ends) columns of the words after the colon of a line
+def line_word_spans(line_content):
+    colon_pos = line_content.find(':')
+    if colon_pos == -1:
+        return [], []
+    matches = list(WORD_PATTERN.finditer(line_content, colon_pos + 1))
+    return [match.start() for match in matches], [match.end() for match in matches]
+
+def index_line_words(text_widget, line_num, line_content):
+    word_indexes.setdefault(text_widget, {})[line_num] = line_word_spans(line_content)
+
+def word_spans(text_widget, line_num):
+    index = word_indexes.setdefault(text_widget, {})
+    spans = index.get(line_num)
+    if spans is None:
+        spans = index[line_num] = line_word_spans(text_widget.get(f"{line_num}.0", f"{line_num}.end"))
+    return spans
+
+def clear_word_index(text_widget):
+    word_indexes.pop(text_widget, None)
+    word_index_line_counts.pop(text_widget, None)
+
+# Update the word index after the user changed a line of a Textbox
+def update_word_index(text_widget, line_num):
+    line_count = int(text_widget.index("end-1c").split(".")[0])
+    if word_index_line_counts.get(text_widget) != line_count:
+        # Lines added or removed: the following lines moved
+        word_indexes.pop(text_widget, None)
+        word_index_line_counts[text_widget] = line_count
+    else:
+        word_indexes.get(text_widget, {}).pop(line_num, None)
+
+# Keep the word index of the original and converted Textboxes up to date when they are typed in
+def on_text_key(event):
+    if event.widget.edit_modified():
+        update_word_index(event.widget, int(event.widget.index(tk.INSERT).split('.')[0]))
+        event.widget.edit_modified(False)
 
 # Highlight notes in the two Textboxes
 def highlight_selection(event=None):
     try:
-        widget = root.focus_get()
+        # The widget whose selection changed, or the focused one without event
+        widget = event.widget if event is not None else root.focus_get()
         if not isinstance(widget, ScrolledText):
             return
-        # Remove previous highlights from all textboxes
-        for text_widget in [original_notes_display, converted_notes_display, editable_notes_display]:
-            text_widget.tag_remove('highlight', '1.0', tk.END)
+        # Remove the previous highlights only
+        for text_widget, start_idx, end_idx in highlighted_ranges:
+            text_widget.tag_remove('highlight', start_idx, end_idx)
+        highlighted_ranges.clear()
         try:
             selection_start = widget.index(tk.SEL_FIRST)
             selection_end = widget.index(tk.SEL_LAST)
         except tk.TclError:
             return
-        # Get measure number and line content
-        start_line = int(selection_start.split('.')[0])
-        line_content = widget.get(f"{start_line}.0", f"{start_line}.end")
-        # Find the position of ":" in the line
-        colon_pos = line_content.find(':')
-        if colon_pos == -1:
+        # Get measure number and the selected columns on that line
+        start_line, start_col = map(int, selection_start.split('.'))
+        end_line, end_col = map(int, selection_end.split('.'))
+        if end_line != start_line:
+            end_col = sys.maxsize
+        # Find which words are selected (numbered from 1): the words overlapping the selection
+        starts, ends = word_spans(widget, start_line)
+        start_word_index = bisect.bisect_right(ends, start_col) + 1
+        end_word_index = bisect.bisect_left(starts, end_col)
+        if start_word_index > end_word_index:
             return
-        # Get the words after the colon
-        words_part = line_content[colon_pos + 1:].strip()
-        words = [word for word in words_part.split() if word]  # Split by whitespace and remove empty strings
-        # Get selected text and its position relative to the words
-        selected_text = widget.get(selection_start, selection_end).strip()
-        text_before_selection = line_content[:int(selection_start.split('.')[1])]
-        text_after_colon = text_before_selection[colon_pos + 1:].strip()
-        words_before = len(text_after_colon.split())
-        # Find which words are selected (adding 1 to start from 1 instead of 0)
-        selected_words = selected_text.split()
-        start_word_index = words_before + 1  # Add 1 here
-        end_word_index = start_word_index + len(selected_words) - 1
         # Create selection display format
         if start_word_index == end_word_index:
             selection_display = f"M{start_line:03d}:[{start_word_index}]"
@@ -168,45 +517,67 @@ def highlight_selection(event=None):
         selection_label.config(text=selection_display)
         # Highlight corresponding words in all textboxes
         for text_widget in [original_notes_display, converted_notes_display, editable_notes_display]:
-            line_content = text_widget.get(f"{start_line}.0", f"{start_line}.end")
-            colon_pos = line_content.find(':')
-            if colon_pos == -1:
+            starts, ends = word_spans(text_widget, start_line)
+            if start_word_index > len(starts):
                 continue
-            # Split words after colon
-            words = line_content[colon_pos + 1:].strip().split()
-            
-            # Find the positions of the selected words
-            current_pos = colon_pos + 1
-            word_count = 0  # Start at 0, will be incremented to 1 before first comparison
-            
-            for word in words:
-                current_pos = line_content.find(word, current_pos)
-                word_count += 1  # Increment before comparison to start counting from 1
-                
-                if start_word_index <= word_count <= end_word_index:
-                    start_idx = f"{start_line}.{current_pos}"
-                    end_idx = f"{start_line}.{current_pos + len(word)}"
-                    text_widget.tag_add('highlight', start_idx, end_idx)
-                    text_widget.tag_configure('highlight', background='yellow')
-                
-                current_pos += len(word)
+            start_idx = f"{start_line}.{starts[start_word_index - 1]}"
+            end_idx = f"{start_line}.{ends[min(end_word_index, len(ends)) - 1]}"
+            text_widget.tag_add('highlight', start_idx, end_idx)
+            highlighted_ranges.append((text_widget, start_idx, end_idx))
     except Exception as e:
         print(f"Error in highlight_selection: {str(e)}")
         
-# Function to open the score in MuseScore
+# Function to copy the selection of the focused Textbox as plain text and as HTML (styled like the export).
+# One Text.dump of the selection gives its styled runs.
 def copy_with_format():
+    widget = root.focus_get()
+    if not isinstance(widget, ScrolledText):
+        return
     try:
-        widget = root.focus_get()
-        if not isinstance(widget, ScrolledText):
-            return
-            
-        selection = widget.get(tk.SEL_FIRST, tk.SEL_LAST)
-        tags = widget.tag_names(tk.SEL_FIRST)
-        
-        root.clipboard_clear()
-        root.clipboard_append(selection)  # Simplifié pour ne copier que le texte
+        lines = text_runs(widget, tk.SEL_FIRST, tk.SEL_LAST)
     except tk.TclError:
-        pass
+        # Aucune sélection
+        return
+    plain_text = "\n".join(''.join(text for text, tags in runs) for runs in lines)
+    tag_styles = {}
+    collect_tag_styles(lines, tag_styles)
+    set_clipboard(plain_text, html_document(tag_styles, [html_line_fragment(runs) for runs in lines]))
+
+# Put plain text and HTML on the clipboard in one operation: both formats of the Windows
+# clipboard (with pywin32), both targets of the X11 clipboard, the plain text only otherwise
+def set_clipboard(plain_text, html_text):
+    if sys.platform == 'win32':
+        try:
+            import win32clipboard
+        except ImportError:
+            win32clipboard = None
+        if win32clipboard is not None:
+            win32clipboard.OpenClipboard()
+            try:
+                win32clipboard.EmptyClipboard()
+                win32clipboard.SetClipboardData(win32clipboard.CF_UNICODETEXT, plain_text)
+                win32clipboard.SetClipboardData(win32clipboard.RegisterClipboardFormat("HTML Format"),
+                                                windows_clipboard_html(html_text))
+            finally:
+                win32clipboard.CloseClipboard()
+            return
+    root.clipboard_clear()
+    root.clipboard_append(plain_text)
+    if root.tk.call('tk', 'windowingsystem') == 'x11':
+        root.clipboard_append(html_text, type='text/html')
+
+# The "HTML Format" of the Windows clipboard: a header with the byte offsets of the document
+# and of the copied fragment (the body)
+CF_HTML_HEADER = "Version:0.9\r\nStartHTML:{:010d}\r\nEndHTML:{:010d}\r\nStartFragment:{:010d}\r\nEndFragment:{:010d}\r\n"
+
+def windows_clipboard_html(html_text):
+    data = (html_text.replace('<body>', '<body><!--StartFragment-->', 1)
+            .replace('</body>', '<!--EndFragment--></body>', 1).encode('utf-8'))
+    header_length = len(CF_HTML_HEADER.format(0, 0, 0, 0))
+    start_fragment = header_length + data.index(b'<!--StartFragment-->') + len(b'<!--StartFragment-->')
+    end_fragment = header_length + data.index(b'<!--EndFragment-->')
+    header = CF_HTML_HEADER.format(header_length, header_length + len(data), start_fragment, end_fragment)
+    return header.encode('ascii') + data
 
 def paste_with_format():
     try:
@@ -233,7 +604,6 @@ def check_musescore_path():
     return False
 
 def open_in_musescore():
-    global current_file_path
     if current_file_path and os.path.exists(current_file_path):
         try:
             root.config(cursor="wait")  # Change le curseur en sablier
@@ -253,6 +623,9 @@ def open_in_musescore():
             for path in musescore_paths:
                 if os.path.exists(path):
                     subprocess.Popen([path, current_file_path])
+                    # The measures saved in MuseScore come back here
+                    watch_var.set(True)
+                    set_watch_enabled(True)
                     break
                     
         except Exception as e:
@@ -262,309 +635,255 @@ def open_in_musescore():
             musescore_button.config(state='normal')  # Réactive le bouton
     else:
         print("No file currently opened")
-        
-# Create Dictionnaries for Strings
-def get_g_string_fingering():
-    return [
-        ('0', 'G3', 'G String'),
-        ('1₁', 'G#3/Ab3', 'G String'),
-        ('1', 'A3', 'G String'),
-        ('1¹', 'A#3/Bb3', 'G String'),
-        ('2', 'B3', 'G String'),
-        ('3₁', 'C4', 'G String'),
-        ('3¹', 'C#4/Db4', 'G String'),
-        ('4', 'D4', 'G String')
-    ]
-
-def get_d_string_fingering():
-    return [
-        ('0', 'D4', 'D String'),
-        ('1₁', 'D#4/Eb4', 'D String'),
-        ('1', 'E4', 'D String'),
-        ('1', 'E-4', 'D String'),
-        ('1¹', 'F4', 'D String'),
-        ('2', 'F#4/Gb4', 'D String'),
-        ('3', 'G4', 'D String'),
-        ('3¹', 'G#4/Ab4', 'D String'),
-        ('4', 'A4', 'D String')
-    ]
-    
-def get_a_string_fingering():
-    return [
-        ('0', 'A4', 'A String'),
-        ('1₁', 'A#4/Bb4', 'A String'),
-        ('1', 'B4', 'A String'),
-        ('1¹', 'C5', 'A String'),
-        ('2', 'C#5/Db5', 'A String'),
-        ('3₁', 'D5', 'A String'),
-        ('3¹', 'D#5/Eb5', 'A String'),
-        ('4', 'E5', 'A String'),
-        ('4', 'E-5', 'A String')
-    ]
-
-# 1st Position
-def get_e_string_fingering():
-    return [
-        ('0', 'E5', 'E String'),
-        ('0', 'E-5', 'E String'),
-        ('1₁', 'F5', 'E String'),
-        ('1', 'F#5/Gb5', 'E String'),
-        ('1¹', 'G5', 'E String'),
-        ('2', 'G#5/Ab5', 'E String'),
-        ('3₁', 'A5', 'E String'),
-        ('3¹', 'A#5/Bb5', 'E String'),
-        ('4', 'B5', 'E String')
-    ]
-
-# 2nd position
-def get_e_string_fingering_position2():
-    return [
-        ('1', 'F5', 'E String'),
-        ('1¹', 'F#5/Gb5', 'E String'),
-        ('2', 'G5', 'E String'),
-        ('2¹', 'G#5/Ab5', 'E String'),
-        ('3', 'A5', 'E String'),
-        ('3¹', 'A#5/Bb5', 'E String'),
-        ('4', 'B5', 'E String'),
-        ('4¹', 'C6', 'E String')
-    ]
-
-# 3th position
-def get_e_string_fingering_position3():
-    return [
-        ('1', 'G5', 'E String'),
-        ('1¹', 'G#5/Ab5', 'E String'),
-        ('2', 'A5', 'E String'),
-        ('2¹', 'A#5/Bb5', 'E String'),
-        ('3', 'B5', 'E String'),
-        ('3¹', 'C6', 'E String'),
-        ('4', 'C#6/Db6', 'E String'),
-        ('4¹', 'D6', 'E String')
-    ]
-
-# 4th position
-def get_e_string_fingering_position4():
-    return [
-        ('1', 'A5', 'E String'),
-        ('1¹', 'A#5/Bb5', 'E String'),
-        ('2', 'B5', 'E String'),
-        ('2¹', 'C6', 'E String'),
-        ('3', 'C#6/Db6', 'E String'),
-        ('3¹', 'D6', 'E String'),
-        ('4', 'D#6/Eb6', 'E String'),
-        ('4¹', 'E6', 'E String')
-    ]
-
-# 5th position
-def get_e_string_fingering_position5():
-    return [
-        ('1', 'B5', 'E String'),
-        ('1¹', 'C6', 'E String'),
-        ('2', 'C#6/Db6', 'E String'),
-        ('2¹', 'D6', 'E String'),
-        ('3', 'D#6/Eb6', 'E String'),
-        ('3¹', 'E6', 'E String'),
-        ('4', 'F6', 'E String'),
-        ('4¹', 'F#6/Gb6', 'E String')
-    ]
-
-# 6th position
-def get_e_string_fingering_position6():
-    return [
-        ('1', 'C6', 'E String'),
-        ('1¹', 'C#6/Db6', 'E String'),
-        ('2', 'D6', 'E String'),
-        ('2¹', 'D#6/Eb6', 'E String'),
-        ('3', 'E6', 'E String'),
-        ('3¹', 'F6', 'E String'),
-        ('4', 'F#6/Gb6', 'E String'),
-        ('4¹', 'G6', 'E String')
-    ]
-
-# 7th position
-def get_e_string_fingering_position7():
-    return [
-        ('1', 'D6', 'E String'),
-        ('1¹', 'D#6/Eb6', 'E String'),
-        ('2', 'E6', 'E String'),
-        ('2¹', 'F6', 'E String'),
-        ('3', 'F#6/Gb6', 'E String'),
-        ('3¹', 'G6', 'E String'),
-        ('4', 'G#6/Ab6', 'E String'),
-        ('4¹', 'A6', 'E String')
-    ]
-
-# Associate colors string (ColourStrings Method)
-string_colors = {
-    'G String': 'green',   # for G
-    'D String': 'red',     # Red for D
-    'A String': 'blue',    # Blue for A
-    'E String': 'brown'    # Brown instead of Yellow because can't see nothing for E
-}
-# Update Positions Colors
-position_colors = {
-    '1': {'background': 'white', 'foreground': 'black'},
-    '2': {'background': 'gray', 'foreground': 'white'},
-    '3': {'background': 'brown', 'foreground': 'white'},
-    '4': {'background': 'purple', 'foreground': 'white'},
-    '5': {'background': 'pink', 'foreground': 'white'},
-    '6': {'background': 'turquoise', 'foreground': 'black'},
-    '7': {'background': 'blue', 'foreground': 'white'},
-}
-
-# Set of notes below the violin range
-low_notes = {
-    'A0', 'A#0', 'Bb0', 'B0', 'C1', 'C#1', 'Db1', 'D1', 'D#1', 'Eb1', 'E1'
-}
-
-# Set of notes above the violin range
-high_notes = {
-    'F6', 'F#6', 'Gb6', 'G6', 'G#6', 'Ab6', 'A6', 'A#6', 'Bb6', 'B6', 'C7', 'C#7',
-    'Db7', 'D7', 'D#7', 'Eb7', 'E7', 'F7', 'F#7', 'Gb7', 'G7'
-}
-
-# Function to display musical measures in different text areas
-def display_measures(score, is_mscx=False):
-    # Clear previous content
-    original_notes_display.delete('1.0', tk.END)
-    converted_notes_display.delete('1.0', tk.END)
+palette_widgets = []
+
+# Function to configure every palette tag on a Text widget
+def configure_palette(text_widget):
+    for tag, style in style_palette.items():
+        text_widget.tag_configure(tag, **style)
+    # Highlight of the selected notes, above every style
+    text_widget.tag_configure('highlight', background='yellow')
+    palette_widgets.append(text_widget)
+
+# Function to get the palette tag for a text colour (added to the palette if new)
+def palette_color_tag(color):
+    tag = f"fg_{color}"
+    if tag not in style_palette:
+        add_palette_tag(tag, {'foreground': color})
+    return tag
+
+# Function to add a tag to the palette and configure it on the Text widgets
+def add_palette_tag(tag, style):
+    style_palette[tag] = style
+    for text_widget in palette_widgets:
+        text_widget.tag_configure(tag, **style)
+
+# Function to map the classes of an exported HTML span onto palette tags.
+# Files written before the palette used one class per note: their CSS rule gives the palette tag.
+def html_class_tags(classes, class_styles):
+    tags = []
+    for css_class in classes:
+        if css_class == 'default':
+            continue
+        if css_class in style_palette:
+            tags.append(css_class)
+            continue
+        style = css_to_style(class_styles.get(css_class, ''))
+        for tag, palette_style in style_palette.items():
+            if style and palette_style == style:
+                tags.append(tag)
+                break
+        else:
+            if list(style) == ['foreground']:
+                tags.append(palette_color_tag(style['foreground']))
+    return tuple(tags)
+
+# Line of the original Textbox for measure i of NoteEvents, as (text, tags) runs
+def original_measure_runs(measures, i):
+    return [(f"M{i+1:03d}: {' '.join(measures.measure_note_names(i))}", ())]
+
+# Display the notes of the measures first to last (excluded) of NoteEvents
+def show_original_measures(measures, first_measure, last_measure):
+    insert_lines(original_notes_display,
+                 [original_measure_runs(measures, i) for i in range(first_measure, last_measure)])
+
+# Lines given to a single Text.insert call
+INSERT_BLOCK_LINES = 200
+
+# Function to add (text, tags) runs to the arguments of Text.insert: text, tag list, text, tag list...
+# Adjacent runs with the same tags become one argument pair.
+def add_insert_args(args, runs):
+    for text, tags in runs:
+        tags = tuple(tags)
+        if args and args[-1] == tags:
+            args[-2] += text
+        else:
+            args += [text, tags]
+            tk_counters['tags'] += len(tags)
+
+# Insert lines of (text, tags) runs at the end of a Textbox. Each block of INSERT_BLOCK_LINES lines
+# is one Text.insert call with the text and tags of all its runs: the tags come with the text
+# (no tag_add afterwards) and the Textbox is laid out once per block.
+def insert_lines(text_widget, lines):
+    line_num = int(text_widget.index("end-1c").split(".")[0])
+    for block_start in range(0, len(lines), INSERT_BLOCK_LINES):
+        args = []
+        for runs in lines[block_start:block_start + INSERT_BLOCK_LINES]:
+            add_insert_args(args, runs)
+            add_insert_args(args, [("\n", ())])
+            index_line_words(text_widget, line_num, ''.join(text for text, tags in runs))
+            line_num += 1
+        text_widget.insert(tk.END, *args)
+        tk_counters['tcl_calls'] += 1
+
+# Python-side model of the opened score. With lazy rendering, the Textboxes only hold
+# the lines above the bottom of the view plus RENDER_MARGIN, more lines come in on scroll.
+RENDER_MARGIN = 100
+lazy_rendering = True
+
+score_notes = NoteEvents()  # notes of the measures
+score_fingerings = []      # (text, tag) per note, per measure
+score_editable_lines = []  # line records (text, ranges) of the editable Textbox
+score_settings = None      # conversion settings of score_fingerings (core.conversion_settings)
+rendered_lines = 0
+
+def reset_score_model():
+    global score_notes, score_fingerings, score_editable_lines, rendered_lines
+    score_notes, score_fingerings, score_editable_lines = NoteEvents(), [], []
+    rendered_lines = 0
+    highlighted_ranges.clear()
+    for text_widget in [original_notes_display, converted_notes_display, editable_notes_display]:
+        text_widget.delete('1.0', tk.END)
+        clear_word_index(text_widget)
+
+# Add converted measures to the model and show the ones in view
+def add_measures(measures, fingerings):
+    for fingering in fingerings:
+        score_editable_lines.append(runs_to_record(fingering_runs(len(score_fingerings), fingering)))
+        score_fingerings.append(fingering)
+    score_notes.extend(measures)
+    refresh_rendering()
+
+# Replace the lines of the editable Textbox (the rendered part is re-rendered)
+def set_editable_lines(lines):
+    global score_editable_lines
+    score_editable_lines = lines
     editable_notes_display.delete('1.0', tk.END)
-
-    # If the score is a list (case of an MSCX file)
-    if is_mscx:
-        measures = score
-    else:
-        # Extract notes per measure, considering repeats (MusicXML case)
-        measures = []
-        for part in score.parts:
-            for measure in part.getElementsByClass(stream.Measure):
-                measure_notes = []
-                for element in measure.flatten().notes:  # Use .flatten() instead of .flat
-                    if isinstance(element, note.Note):
-                        measure_notes.append(element)
-                measures.append(measure_notes)
-
-    # Display notes per measure with string color
-    for i, measure in enumerate(measures):
-        block_notes_str = " ".join([f"{n.nameWithOctave}" if isinstance(n, note.Note) else n for n in measure])
-        measure_label = f"M{i+1:03d}: "
-        original_notes_display.insert(tk.END, f"{measure_label}{block_notes_str}\n")  # Add newline
+    clear_word_index(editable_notes_display)
+    insert_lines(editable_notes_display, [record_to_runs(record) for record in score_editable_lines[:rendered_lines]])
+    editable_notes_display.edit_modified(False)
+    refresh_rendering()
+
+# Number of lines of the model
+def model_line_count():
+    return max(score_notes.measure_count(), len(score_editable_lines))
+
+# Render the model lines up to line_count in the three Textboxes
+def render_lines(line_count):
+    global rendered_lines
+    line_count = min(line_count, model_line_count())
+    if line_count <= rendered_lines:
+        return
+    start = rendered_lines
+    show_original_measures(score_notes, start, min(line_count, score_notes.measure_count()))
+    insert_lines(converted_notes_display, [fingering_runs(i, fingering) for i, fingering
+                                           in enumerate(score_fingerings[start:line_count], start=start)])
+    insert_lines(editable_notes_display, [record_to_runs(record) for record in score_editable_lines[start:line_count]])
+    rendered_lines = line_count
+    # Rendering is not a user edit
+    editable_notes_display.edit_modified(False)
+
+# Render what is in view plus the margin, or everything without lazy rendering
+def refresh_rendering():
+    if not lazy_rendering:
+        render_lines(model_line_count())
+        return
+    last_visible_line = 0
+    for text_widget in [original_notes_display, converted_notes_display, editable_notes_display]:
+        bottom = text_widget.index(f"@0,{text_widget.winfo_height()}")
+        last_visible_line = max(last_visible_line, int(bottom.split('.')[0]))
+    render_lines(last_visible_line + RENDER_MARGIN)
+
+# Lines of the model not rendered yet, for the export
+def unrendered_editable_lines():
+    return score_editable_lines[rendered_lines:]
+
+# The editable lines as the user left them: the rendered ones from the Textbox, the others from the model
+def current_editable_lines():
+    return [runs_to_record(runs) for runs in text_runs(editable_notes_display)[:-1]] + unrendered_editable_lines()
+
+def set_lazy_rendering(enabled):
+    global lazy_rendering
+    lazy_rendering = enabled
+    refresh_rendering()
+
+# Keep the three Textboxes on the same top line and render more lines when scrolling
+syncing_scroll = False
+
+def on_text_scroll(text_widget, first, last):
+    global syncing_scroll
+    text_widget.vbar.set(first, last)
+    if syncing_scroll:
+        return
+    syncing_scroll = True
+    try:
+        top_line = text_widget.index('@0,0').split('.')[0]
+        for other in [original_notes_display, converted_notes_display, editable_notes_display]:
+            if other is not text_widget and other.index('@0,0').split('.')[0] != top_line:
+                other.yview(f"{top_line}.0")
+    finally:
+        syncing_scroll = False
+    if lazy_rendering and rendered_lines < model_line_count():
+        root.after_idle(refresh_rendering)
 
 # Function to convert notes to violin fingering
+# The notes of the score model are converted again with the current settings: the converted Textbox
+# is rebuilt, and the editable lines still holding the old fingering get the new one (the user's
+# fingering is kept)
 def convert_to_violin():
-    lines = original_notes_display.get('1.0', tk.END).splitlines()
-    for i, line in enumerate(lines):
-        if line.startswith("M"):
-            notes_str = line[5:]
-            notes = notes_str.split(" ")
-            measure_label = f"M{i+1:03d}: "
-            converted_notes_display.insert(tk.END, f"{measure_label}")
-            editable_notes_display.insert(tk.END, f"{measure_label}")
-            for note_name in notes:
-                if note_name == "":
-                    continue
-
-                # Check if the note is outside the violin range
-                if note_name in low_notes:
-                    # Notes lower than G3
-                    converted_notes_display.insert(tk.END, f"{note_name}", (f"low_{i}_{note_name}",))
-                    editable_notes_display.insert(tk.END, f"{note_name}", (f"low_{i}_{note_name}",))
-                    converted_notes_display.tag_config(f"low_{i}_{note_name}", foreground='green', background='black')
-                    editable_notes_display.tag_config(f"low_{i}_{note_name}", foreground='green', background='black')
-                    converted_notes_display.insert(tk.END, " ")
-                    editable_notes_display.insert(tk.END, " ")
-                    continue
-                elif note_name in high_notes:
-                    # Notes higher than E6
-                    converted_notes_display.insert(tk.END, f"{note_name}", (f"high_{i}_{note_name}",))
-                    editable_notes_display.insert(tk.END, f"{note_name}", (f"high_{i}_{note_name}",))
-                    converted_notes_display.tag_config(f"high_{i}_{note_name}", foreground='turquoise', background='black')
-                    editable_notes_display.tag_config(f"high_{i}_{note_name}", foreground='turquoise', background='black')
-                    converted_notes_display.insert(tk.END, " ")
-                    editable_notes_display.insert(tk.END, " ")
-                    continue
-
-                # Then Check G, D, and A strings
-                possibilities = []
-                for df in [fingering_df_g_string, fingering_df_d_string, fingering_df_a_string]:
-                    result = df[df['Note'].str.contains(note_name, na=False)]
-                    if not result.empty:
-                        possibilities.append(result.iloc[0])
-
-                if len(possibilities) == 1:
-                    finger = possibilities[0]['Fingers Used']
-                    string = possibilities[0]['String']
-                elif len(possibilities) > 1:
-                    best_choice = min(possibilities, key=lambda x: int(x['Fingers Used'].strip('₁¹')))
-                    finger = best_choice['Fingers Used']
-                    string = best_choice['String']
-                else:
-                    finger, string = "?", None
-
-                color = string_colors.get(string, 'black')
-                if finger != "?":
-                    converted_notes_display.insert(tk.END, f"{finger}", (f"color_{i}_{note_name}",))
-                    editable_notes_display.insert(tk.END, f"{finger}", (f"color_{i}_{note_name}",))
-                    converted_notes_display.tag_config(f"color_{i}_{note_name}", foreground=color)
-                    editable_notes_display.tag_config(f"color_{i}_{note_name}", foreground=color)
-                    converted_notes_display.insert(tk.END, " ")
-                    editable_notes_display.insert(tk.END, " ")
-                    continue
-
-                # Try successive positions on the E string (priority order)
-                possibilities = []
-                for position, get_fingering_function in enumerate(
-                    [get_e_string_fingering, get_e_string_fingering_position3, get_e_string_fingering_position5,
-                     get_e_string_fingering_position7, get_e_string_fingering_position2, get_e_string_fingering_position4,
-                     get_e_string_fingering_position6], start=1):
-                    
-                    possibilities += [pos for pos in get_fingering_function() if note_name in pos[1]]
-
-                if possibilities:
-                    best_choice = min(possibilities, key=lambda x: int(x[0].strip('₁¹')))
-                    finger = best_choice[0]
-                    string = best_choice[2]
-                    color_info = position_colors[str(position)]
-                    converted_notes_display.insert(tk.END, f"{finger}", (f"position_{i}_{note_name}",))
-                    editable_notes_display.insert(tk.END, f"{finger}", (f"position_{i}_{note_name}",))
-                    converted_notes_display.tag_config(f"position_{i}_{note_name}",
-                                                       foreground=color_info['foreground'],
-                                                       background=color_info['background'])
-                    editable_notes_display.tag_config(f"position_{i}_{note_name}",
-                                                      foreground=color_info['foreground'],
-                                                      background=color_info['background'])
-                    converted_notes_display.insert(tk.END, " ")
-                    editable_notes_display.insert(tk.END, " ")
-                    continue
-
-                # If the note does not match any category
-                converted_notes_display.insert(tk.END, f"?", (f"unknown_{i}_{note_name}",))
-                editable_notes_display.insert(tk.END, f"?", (f"unknown_{i}_{note_name}",))
-                converted_notes_display.tag_config(f"unknown_{i}_{note_name}", foreground='white', background='red')
-                editable_notes_display.tag_config(f"unknown_{i}_{note_name}", foreground='white', background='red')
-                converted_notes_display.insert(tk.END, " ")
-                editable_notes_display.insert(tk.END, " ")
-
-            converted_notes_display.insert(tk.END, "\n")
-            editable_notes_display.insert(tk.END, "\n")
+    global score_fingerings, score_settings, full_save_needed
+    old_fingerings = score_fingerings
+    fingerings = []
+    for batch in measure_batches(score_notes):
+        fingerings.extend(convert_measures(batch))
+    score_fingerings, score_settings = fingerings, core.conversion_settings()
+    converted_notes_display.delete('1.0', tk.END)
+    clear_word_index(converted_notes_display)
+    insert_lines(converted_notes_display, [fingering_runs(i, fingering)
+                                           for i, fingering in enumerate(score_fingerings[:rendered_lines])])
+    old_editable = current_editable_lines()
+    # Lines added or removed by the user: they no longer follow the measures
+    if len(old_editable) == len(old_fingerings):
+        new_editable = [runs_to_record(fingering_runs(i, fingerings[i]))
+                        if record == runs_to_record(fingering_runs(i, old_fingerings[i])) else record
+                        for i, record in enumerate(old_editable)]
+        if new_editable != old_editable:
+            set_editable_lines(new_editable)
+            # The sidecar and HTML follow the new fingering
+            full_save_needed = True
+            schedule_autosave()
+    refresh_rendering()
+
+# Switch instrument (standard tuning) for the next conversions, the legend shows its highest string.
+# The opened score is converted again, or at the end of its load.
+def change_instrument(name):
+    set_instrument(name)
+    string_legend_label.config(text=f"{core.instrument_strings[-1]}:")
+    if current_load_job is None and score_notes.measure_count():
+        convert_to_violin()
+
+# Switch the fingering choice, the opened score is converted again like for the instrument
+def change_fingering_mode(mode):
+    set_fingering_mode(mode)
+    if current_load_job is None and score_notes.measure_count():
+        convert_to_violin()
+
+# Lines where the next change of editable_notes_display may start: the insertion cursor and the
+# selection when a key or a button is pressed (before the change), and the line clicked (middle-click paste)
+edit_start_lines = ()
+
+def on_edit_press(event):
+    global edit_start_lines
+    widget = editable_notes_display
+    indexes = [widget.index(tk.INSERT)]
+    if widget.tag_ranges(tk.SEL):
+        indexes += [widget.index(tk.SEL_FIRST), widget.index(tk.SEL_LAST)]
+    if str(event.type) == 'ButtonPress':
+        indexes.append(widget.index(f"@{event.x},{event.y}"))
+    edit_start_lines = [int(index.split('.')[0]) for index in indexes]
 
 # Save modifications when the content of editable_notes_display changes
-# Modifiez la fonction `on_edit` pour détecter l'événement "Entrée"
+# <<Modified>> suit chaque modification (frappe, collage, coupure) : les lignes depuis son début
+# jusqu'au curseur sont marquées, l'autosave regroupe les modifications
 def on_edit(event):
-    global current_file_path
-    if event.keysym == 'Return':  # Vérifie si la touche pressée est "Entrée"
-        if current_file_path:
-            save_as_html(current_file_path)  # Sauvegarde du fichier HTML
-            file_label.config(text=f"Last saved: {os.path.basename(current_file_path)}")
-        editable_notes_display.edit_modified(False)
-
-
-# Function to convert MIDI number to note name
-def midi_to_note_name(midi_number):
-    note_names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-    octave = (midi_number // 12) - 1
-    note_index = midi_number % 12
-    return f"{note_names[note_index]}{octave}"
+    if not editable_notes_display.edit_modified():
+        return
+    lines = [int(editable_notes_display.index(tk.INSERT).split('.')[0]), *edit_start_lines]
+    first_line, last_line = min(lines), max(lines)
+    for changed_line in range(first_line, last_line + 1):
+        update_word_index(editable_notes_display, changed_line)
+    mark_lines_dirty(first_line, last_line)
+    editable_notes_display.edit_modified(False)
 
 # Change the color of the selection in the third Textbox
 def change_color(color):
@@ -574,223 +893,537 @@ def change_color(color):
             selection_end = editable_notes_display.index(tk.SEL_LAST)
         except tk.TclError:
             return
-        tag_name = f'color_{selection_start}_{selection_end}'
+        tag_name = palette_color_tag(color)
+        # The new colour replaces the previous one instead of stacking another tag
+        for tag in style_palette:
+            if tag.startswith('fg_') and tag != tag_name:
+                editable_notes_display.tag_remove(tag, selection_start, selection_end)
         editable_notes_display.tag_add(tag_name, selection_start, selection_end)
-        editable_notes_display.tag_configure(tag_name, foreground=color)
-        
-# Replace save_modifications function with save_as_html
-def save_as_html(file_path):
-    if not file_path:
+        mark_lines_dirty(int(selection_start.split('.')[0]), int(selection_end.split('.')[0]))
+
+# Right click on a note of the editable Textbox: menu of its fingerings on the whole fingerboard
+def show_fingering_menu(event):
+    widget = editable_notes_display
+    line_num, col = map(int, widget.index(f"@{event.x},{event.y}").split('.'))
+    # Line n is measure n - 1, word k of the line is note k of the measure
+    measure = line_num - 1
+    if measure >= score_notes.measure_count():
         return
-    # Définir le chemin du fichier HTML
-    directory = os.path.dirname(file_path)
-    base_name = os.path.splitext(os.path.basename(file_path))[0]
-    html_path = os.path.join(directory, f"{base_name}_fingering.html")
-
-    # Préparer le contenu HTML avec les styles
-    html_content = ['<!DOCTYPE html>', '<html>', '<head>', '<style>']
-    html_content.append('''
-        body { white-space: pre-wrap; font-family: monospace; }
-        .default { color: black; }  /* Style par défaut */
-    ''')
-
-    # Récupérer les styles de chaque tag utilisé dans editable_notes_display
-    tags_used = {}
-    for tag in editable_notes_display.tag_names():
-        if tag not in ('sel', 'highlight'):
-            config = editable_notes_display.tag_configure(tag)
-            style = ""
-            if 'foreground' in config:
-                style += f"color: {config['foreground'][4]};"
-            if 'background' in config:
-                style += f" background-color: {config['background'][4]};"
-            tags_used[tag] = style
-
-    # Ajouter les styles des tags dans le HTML
-    for tag, style in tags_used.items():
-        html_content.append(f'.{tag} {{ {style} }}')
-    html_content.extend(['</style>', '</head>', '<body>'])
-
-    # Traitement ligne par ligne du contenu de editable_notes_display
-    total_lines = int(editable_notes_display.index("end-1c").split(".")[0])
-    for line_num in range(1, total_lines + 1):
-        line_start = f"{line_num}.0"
-        line_end = f"{line_num}.end"
-        line_text = editable_notes_display.get(line_start, line_end)
-
-        # Démarrer une nouvelle ligne avec un div pour chaque mesure
-        html_content.append('<div class="measure">')
-        for pos in range(len(line_text)):
-            current_pos = f"{line_num}.{pos}"
-            char = editable_notes_display.get(current_pos)
-            tags = editable_notes_display.tag_names(current_pos)
-            
-            # Vérification et ajout des tags manquants
-            if not tags:
-                tags = ['default']  # Utiliser un tag 'default' pour les caractères non stylés
-
-            tag_classes = ' '.join(tags)
+    starts, ends = word_spans(widget, line_num)
+    word = bisect.bisect_right(ends, col)
+    first, last = score_notes.note_range(measure)
+    if word >= len(starts) or starts[word] > col or word >= last - first:
+        return
+    alternatives = fingering_alternatives(score_notes.pitch[first + word])
+    if not alternatives:
+        return
+    menu = tk.Menu(root, tearoff=0)
+    for fingering in alternatives:
+        finger, string, position = fingering
+        text, tag = styled_fingering(fingering)
+        menu.add_command(label=f"{finger}  {string}, position {position}",
+                         command=lambda text=text, tag=tag: replace_fingering(line_num, starts[word], ends[word], text, tag))
+    menu.tk_popup(event.x_root, event.y_root)
+
+# Replace a fingering of the editable Textbox by the one chosen in the menu
+def replace_fingering(line_num, start, end, text, tag):
+    editable_notes_display.delete(f"{line_num}.{start}", f"{line_num}.{end}")
+    editable_notes_display.insert(f"{line_num}.{start}", text, (tag,))
+    update_word_index(editable_notes_display, line_num)
+    mark_lines_dirty(line_num, line_num)
+    editable_notes_display.edit_modified(False)
+
+# Function to get the lines of a Text widget as lists of (text, tags) runs.
+# One Text.dump call gives the text and the tag toggles, so the cost follows the
+# number of styled runs instead of the number of characters.
+def text_runs(text_widget, start="1.0", end="end-1c", ignored_tags=('sel', 'highlight')):
+    lines = [[]]
+    # Tags already active at the start of the range
+    active = [tag for tag in text_widget.tag_names(start) if tag not in ignored_tags]
+    for key, value, index in text_widget.dump(start, end, text=True, tag=True):
+        if key == 'tagon':
+            if value not in ignored_tags and value not in active:
+                active.append(value)
+        elif key == 'tagoff':
+            if value in active:
+                active.remove(value)
+        elif key == 'text':
+            tags = tuple(active)
+            for line_index, chunk in enumerate(value.split('\n')):
+                if line_index:
+                    lines.append([])
+                if not chunk:
+                    continue
+                runs = lines[-1]
+                if runs and runs[-1][1] == tags:
+                    runs[-1] = (runs[-1][0] + chunk, tags)
+                else:
+                    runs.append((chunk, tags))
+    return lines
 
-            # Encapsuler chaque caractère dans un span avec les classes de tag
-            if tag_classes:
-                html_content.append(f'<span class="{tag_classes}">{char}</span>')
+# Function to add the CSS of the tags used in lines of runs to tag_styles
+def collect_tag_styles(lines, tag_styles):
+    for runs in lines:
+        for text, tags in runs:
+            for tag in tags:
+                if tag not in tag_styles:
+                    config = editable_notes_display.tag_configure(tag)
+                    tag_styles[tag] = style_to_css({option: config[option][4] for option in ('foreground', 'background')
+                                                    if option in config})
+
+# HTML and sidecar JSON of the editable lines as last saved: only the changed lines are rendered again
+saved_line_fragments = []
+saved_sidecar_fragments = []
+saved_tag_styles = {}
+dirty_lines = set()
+known_line_total = 0
+full_save_needed = True
+
+# Number of lines of the editable Textbox, including the ones not rendered yet
+def editable_line_total():
+    return int(editable_notes_display.index("end-1c").split(".")[0]) + len(unrendered_editable_lines())
+
+# Function to render the HTML fragments of every editable line
+def render_all_fragments():
+    global saved_line_fragments, saved_sidecar_fragments, saved_tag_styles, known_line_total, full_save_needed
+    # Runs de texte ligne par ligne : les caractères contigus avec les mêmes tags forment un seul span
+    lines = text_runs(editable_notes_display)
+    # Affichage paresseux : les lignes pas encore affichées viennent du modèle
+    pending_lines = [record_to_runs(record) for record in unrendered_editable_lines()]
+    if pending_lines:
+        lines = lines[:-1] + pending_lines + [lines[-1]]
+
+    # Récupérer les styles des tags réellement utilisés dans editable_notes_display
+    saved_tag_styles = {}
+    collect_tag_styles(lines, saved_tag_styles)
+    saved_line_fragments = [html_line_fragment(runs) for runs in lines]
+    saved_sidecar_fragments = [sidecar_line_fragment(runs_to_record(runs)) for runs in lines]
+    known_line_total = len(saved_line_fragments)
+    full_save_needed = False
+    dirty_lines.clear()
+
+# Function to render again the HTML fragments of the changed lines only
+def render_dirty_fragments():
+    widget_lines = int(editable_notes_display.index("end-1c").split(".")[0])
+    if full_save_needed or len(saved_line_fragments) != editable_line_total():
+        render_all_fragments()
+        return
+    for line_num in sorted(dirty_lines):
+        if line_num > widget_lines:
+            continue
+        runs = text_runs(editable_notes_display, f"{line_num}.0", f"{line_num}.end")[0]
+        collect_tag_styles([runs], saved_tag_styles)
+        # The last widget line comes after the lines not rendered yet
+        index = line_num - 1 if line_num < widget_lines else len(saved_line_fragments) - 1
+        saved_line_fragments[index] = html_line_fragment(runs)
+        saved_sidecar_fragments[index] = sidecar_line_fragment(runs_to_record(runs))
+    dirty_lines.clear()
+
+# Autosave: edits are coalesced for AUTOSAVE_DELAY_MS, then the changed lines are
+# rendered again and the file is written by a background thread
+AUTOSAVE_DELAY_MS = 1000
+autosave_executor = ThreadPoolExecutor(max_workers=1)
+autosave_after_id = None
+
+# Mark lines of the editable Textbox as changed and schedule the autosave
+def mark_lines_dirty(first_line, last_line):
+    global known_line_total, full_save_needed
+    # Lines added or removed shift every following line
+    line_total = editable_line_total()
+    if line_total != known_line_total:
+        known_line_total = line_total
+        full_save_needed = True
+    dirty_lines.update(range(first_line, last_line + 1))
+    schedule_autosave()
+
+def schedule_autosave():
+    global autosave_after_id
+    if autosave_after_id is not None:
+        root.after_cancel(autosave_after_id)
+    autosave_after_id = root.after(AUTOSAVE_DELAY_MS, autosave)
+
+# Run the pending autosave now (before another file is opened)
+def flush_autosave():
+    if autosave_after_id is not None:
+        root.after_cancel(autosave_after_id)
+        autosave()
+
+# Closing the window: the edits of the last AUTOSAVE_DELAY_MS are saved, and written, before leaving
+def close_window():
+    flush_autosave()
+    autosave_executor.shutdown(wait=True)
+    root.destroy()
+
+def autosave():
+    global autosave_after_id
+    autosave_after_id = None
+    # Pas de sauvegarde pendant le chargement, ni après un chargement annulé ou en erreur :
+    # le fichier HTML serait écrasé par une partition incomplète
+    if loaded_file_path is None or loaded_file_path != current_file_path or current_load_job is not None:
+        return
+    render_dirty_fragments()
+    html_path = get_html_path(current_file_path, current_parts)
+    html_data = html_document(saved_tag_styles, saved_line_fragments).encode('utf-8')
+    sidecar_data = saved_sidecar_document().encode('utf-8')
+    future = autosave_executor.submit(write_saved_files, [(html_path, html_data),
+                                                          (get_sidecar_path(current_file_path, current_parts), sidecar_data)])
+    root.after(100, check_autosave, future, html_path)
+
+# Written by the autosave thread
+def write_saved_files(files):
+    for path, data in files:
+        write_atomically(path, data)
+
+# Sidecar document of the last saved state, with the palette style of each tag used
+def saved_sidecar_document():
+    styles = {tag: style_palette.get(tag) or css_to_style(css) for tag, css in saved_tag_styles.items()}
+    return sidecar_document(styles, saved_sidecar_fragments, current_parts)
+
+# Report the end of a background write in the file label
+def check_autosave(future, html_path):
+    if not future.done():
+        root.after(100, check_autosave, future, html_path)
+    elif future.exception() is not None:
+        file_label.config(text=f"Error saving: {os.path.basename(html_path)}")
+        print(f"Error saving {html_path}: {future.exception()}")
+    else:
+        file_label.config(text=f"Last saved: {os.path.basename(html_path)}")
+
+# Start from a clean state once a file is loaded: the first autosave renders everything
+def reset_autosave():
+    global full_save_needed, known_line_total
+    dirty_lines.clear()
+    full_save_needed = True
+    known_line_total = editable_line_total()
+
+# Watch mode: the opened file is checked every WATCH_INTERVAL_MS. Once a save is complete (the file
+# didn't change for one more interval), it is read again by a worker thread and only the measures
+# whose notes changed are converted and rendered again. The user's lines of the unchanged measures stay.
+WATCH_INTERVAL_MS = 1000
+watch_enabled = False
+watch_after_id = None
+watched_stat = None
+pending_stat = None
+watch_future = None
+watch_executor = ThreadPoolExecutor(max_workers=1)
+
+# Modification time and size of a file, None if it can't be read
+def file_stat(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+# Start from the current state of a file being opened
+def start_watching(file_path):
+    global watched_stat, pending_stat
+    watched_stat = file_stat(file_path)
+    pending_stat = None
+
+def set_watch_enabled(enabled):
+    global watch_enabled, watch_after_id
+    watch_enabled = enabled
+    if watch_after_id is not None:
+        root.after_cancel(watch_after_id)
+        watch_after_id = None
+    if enabled:
+        if current_file_path:
+            start_watching(current_file_path)
+        watch_after_id = root.after(WATCH_INTERVAL_MS, check_watched_file)
+
+def check_watched_file():
+    global watch_after_id, watched_stat, pending_stat, watch_future
+    watch_after_id = root.after(WATCH_INTERVAL_MS, check_watched_file)
+    # Nothing to compare with while a file is loading or the previous save is being read
+    if not current_file_path or current_load_job is not None or watch_future is not None:
+        return
+    stat = file_stat(current_file_path)
+    if stat is None or stat == watched_stat:
+        pending_stat = None
+        return
+    if stat != pending_stat:
+        # Wait for the end of the save
+        pending_stat = stat
+        return
+    watched_stat, pending_stat = stat, None
+    file_label.config(text=f"Reading changes: {os.path.basename(current_file_path)}")
+    settings = core.conversion_settings()
+    watch_future = watch_executor.submit(reread_score, current_file_path, score_notes, score_fingerings,
+                                         score_settings, settings, current_parts)
+    root.after(50, check_watch_future, watch_future, current_file_path, settings)
+
+def check_watch_future(future, file_path, settings):
+    global watch_future, score_settings
+    if not future.done():
+        root.after(50, check_watch_future, future, file_path, settings)
+        return
+    watch_future = None
+    # Another file was opened meanwhile
+    if file_path != current_file_path or current_load_job is not None:
+        return
+    if future.exception() is not None:
+        file_label.config(text=f"Error reading changes: {os.path.basename(file_path)}")
+        print(f"Error reading {file_path}: {future.exception()}")
+        return
+    events, fingerings, opcodes, converted = future.result()
+    apply_score_changes(events, fingerings, opcodes)
+    score_settings = settings
+    # Instrument or fingering mode changed during the reading
+    if score_settings != core.conversion_settings():
+        convert_to_violin()
+    file_label.config(text=f"File updated: {os.path.basename(file_path)} ({converted} measures converted)")
+
+# Replace the content of a rendered line of a Textbox by a line record
+def replace_line(text_widget, line_num, record):
+    text = record[0]
+    text_widget.delete(f"{line_num}.0", f"{line_num}.end")
+    args = []
+    add_insert_args(args, record_to_runs(record))
+    if args:
+        text_widget.insert(f"{line_num}.0", *args)
+    tk_counters['tcl_calls'] += 2
+    index_line_words(text_widget, line_num, text)
+
+# Put the new reading of the score in the model and the Textboxes.
+# When no measure moved, only the changed lines are rendered again; otherwise the lines from
+# the first change on are (their "M001:" labels moved too), within the lazy rendering window.
+def apply_score_changes(events, fingerings, opcodes):
+    global score_notes, score_fingerings, score_editable_lines, rendered_lines, full_save_needed
+    old_fingerings = score_fingerings
+    old_editable = current_editable_lines()
+    # The user's lines no longer follow the measures (lines added or removed): they are left as they are
+    keep_editable = len(old_editable) != score_notes.measure_count()
+    if keep_editable:
+        print("The editable lines don't match the measures, they are not updated")
+
+    new_editable = list(old_editable)
+    if not keep_editable:
+        new_editable = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                new_editable.extend(relabel_record(old_editable[i], j) for i, j in zip(range(i1, i2), range(j1, j2)))
             else:
-                html_content.append(char)  # Ajouter le caractère directement si pas de tag
-
-        # Fermer le div de la mesure avec un saut de ligne visuel
-        html_content.append('</div>')
-
-    html_content.extend(['</body>', '</html>'])
-
-    # Écrire le contenu HTML dans le fichier
-    with open(html_path, 'w', encoding='utf-8') as f:
-        f.write(''.join(html_content))  # Écrire sans ajouter de sauts de ligne
-
-    # Mise à jour de l'interface pour indiquer la sauvegarde
-    file_label.config(text=f"Last saved: {os.path.basename(html_path)}")
-
-
+                new_editable.extend(runs_to_record(fingering_runs(j, fingerings[j])) for j in range(j1, j2))
 
+    score_notes, score_fingerings, score_editable_lines = events, fingerings, new_editable
+    changes = [opcode for opcode in opcodes if opcode[0] != 'equal']
+    if not changes:
+        return
+    if all(i1 == j1 and i2 == j2 for tag, i1, i2, j1, j2 in changes):
+        # Measures replaced in place
+        changed_lines = {j for tag, i1, i2, j1, j2 in changes for j in range(j1, j2)}
+        for j in sorted(changed_lines | {j for j in range(len(fingerings)) if fingerings[j] != old_fingerings[j]}):
+            if j >= rendered_lines:
+                continue
+            if j in changed_lines:
+                replace_line(original_notes_display, j + 1, runs_to_record(original_measure_runs(events, j)))
+                if not keep_editable:
+                    replace_line(editable_notes_display, j + 1, score_editable_lines[j])
+            replace_line(converted_notes_display, j + 1, runs_to_record(fingering_runs(j, fingerings[j])))
+    else:
+        first_change = min(j1 for tag, i1, i2, j1, j2 in changes)
+        widgets = [original_notes_display, converted_notes_display]
+        if not keep_editable:
+            widgets.append(editable_notes_display)
+        if first_change < rendered_lines:
+            for text_widget in widgets:
+                text_widget.delete(f"{first_change + 1}.0", tk.END)
+                clear_word_index(text_widget)
+            if keep_editable:
+                # Only the original and converted lines are rendered again
+                lines = range(first_change, min(rendered_lines, len(fingerings)))
+                insert_lines(original_notes_display,
+                             [original_measure_runs(events, j) if j < events.measure_count() else [(f"M{j+1:03d}: ", ())]
+                              for j in lines])
+                insert_lines(converted_notes_display, [fingering_runs(j, fingerings[j]) for j in lines])
+            else:
+                rendered_lines = first_change
+    editable_notes_display.edit_modified(False)
+    refresh_rendering()
+    if not keep_editable:
+        # The sidecar and HTML follow the new measures
+        full_save_needed = True
+        schedule_autosave()
 
 
 def refresh_text_display():
     """Refresh the editable_notes_display content to reapply styles and ensure format consistency."""
-    content = editable_notes_display.get("1.0", tk.END)
+    # One dump gives the styled runs of every line, written back with their tags by block inserts
+    lines = text_runs(editable_notes_display)
     editable_notes_display.delete("1.0", tk.END)
-    editable_notes_display.insert("1.0", content)
-
-    # Reapply all tags to ensure they display correctly after reloading
-    for line_num in range(1, int(editable_notes_display.index("end-1c").split(".")[0]) + 1):
-        line_start = f"{line_num}.0"
-        line_end = f"{line_num}.end"
-        line_text = editable_notes_display.get(line_start, line_end)
-        for pos in range(len(line_text)):
-            current_pos = f"{line_num}.{pos}"
-            tags = editable_notes_display.tag_names(current_pos)
-            for tag in tags:
-                editable_notes_display.tag_add(tag, current_pos, f"{current_pos}+1c")
-
-    
-
-
-
-# Function to copy text with formatting from one textbox to another
-def copy_with_format():
+    clear_word_index(editable_notes_display)
+    ends_with_newline = not lines[-1]
+    insert_lines(editable_notes_display, lines[:-1] if ends_with_newline else lines)
+    if not ends_with_newline:
+        editable_notes_display.delete("end-2c")
+    editable_notes_display.edit_modified(False)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Convert MuseScore and MusicXML scores to violin fingering. "
+                                                 "Without any path, the window is opened.")
+    parser.add_argument('paths', nargs='*', help="Scores or directories of scores to convert without the window")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: number of cores)")
+    parser.add_argument('-o', '--output-dir', help="Directory for the HTML files (default: next to each score)")
+    parser.add_argument('--summary', help="Write the per-file timings and failures to this JSON file")
+    parser.add_argument('--force', action='store_true',
+                        help="Overwrite the existing HTML files (default: skip their scores, they may hold your edits)")
+    parser.add_argument('--engine', choices=MUSICXML_ENGINES, default='auto',
+                        help="MusicXML reader: native, music21, or native with music21 fallback (default: auto)")
+    parser.add_argument('--fingering', choices=FINGERING_MODES, default='greedy',
+                        help="Fingering choice: note by note, or optimized over each phrase (default: greedy)")
+    parser.add_argument('--instrument', choices=list(INSTRUMENTS), default='violin',
+                        help="Instrument whose fingering is written (default: violin)")
+    parser.add_argument('--tuning',
+                        help="Scordatura: open strings from the lowest, like \"G3 D4 A4 D5\" (default: standard tuning)")
+    parser.add_argument('--parts', default='all',
+                        help="Parts to convert: all (default), violin, or part names or numbers separated by commas")
+    parser.add_argument('--profile', choices=PROFILERS,
+                        help="Profile each file opened in the window, the report is written next to the score")
+    parser.add_argument('--watch', action='store_true',
+                        help="Convert again the measures changed each time the opened file is saved")
+    parser.add_argument('--phrase-measures', type=int, default=core.OPTIMIZER_PHRASE_MEASURES,
+                        help="Measures per phrase for the optimized fingering, 0 for the whole part (default: 0)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
     try:
-        # Récupérer la sélection dans editable_notes_display
-        selection_start = editable_notes_display.index(tk.SEL_FIRST)
-        selection_end = editable_notes_display.index(tk.SEL_LAST)
-        selected_text = editable_notes_display.get(selection_start, selection_end)
-        
-        # Construire le HTML du texte sélectionné
-        html_content = ['<!DOCTYPE html>', '<html>', '<body>', '<pre>']  # Utilise <pre> pour conserver les espaces
-        
-        current_index = selection_start
-        while current_index != selection_end:
-            # Récupérer le caractère et ses tags
-            char = editable_notes_display.get(current_index)
-            tags = editable_notes_display.tag_names(current_index)
-            
-            # Construire un span avec les styles
-            if tags:
-                tag_classes = ' '.join(tags)
-                html_content.append(f'<span class="{tag_classes}">{char}</span>')
-            else:
-                html_content.append(char)
-                
-            # Passer au caractère suivant
-            current_index = editable_notes_display.index(f"{current_index}+1c")
-        
-        html_content.extend(['</pre>', '</body>', '</html>'])
-        
-        # Convertir en une seule chaîne de HTML
-        html_to_copy = ''.join(html_content)
-
-        # Copier le texte brut et le HTML dans le presse-papiers
-        pyperclip.copy(selected_text)  # Copie le texte brut
-        pyperclip.copy(html_to_copy)  # Copie le HTML formaté
-
-        messagebox.showinfo("Copie", "Texte copié avec formatage HTML dans le presse-papiers!")
-    except tk.TclError:
-        messagebox.showwarning("Erreur", "Aucune sélection n'a été faite.")
-
-
-
-# Creating DataFrames
-fingering_df_g_string = pd.DataFrame(get_g_string_fingering(), columns=['Fingers Used', 'Note', 'String'])
-fingering_df_d_string = pd.DataFrame(get_d_string_fingering(), columns=['Fingers Used', 'Note', 'String'])
-fingering_df_a_string = pd.DataFrame(get_a_string_fingering(), columns=['Fingers Used', 'Note', 'String'])
-fingering_df_e_string = pd.DataFrame(get_e_string_fingering(), columns=['Fingers Used', 'Note', 'String'])
-
-
-
-# Set up GUI components
-root = tk.Tk()
-root.title("MusicXML Note & Fingering Display")
-root.geometry("1200x600")  # Set window size
-root.bind('<Control-c>', lambda e: copy_with_format())
-root.bind('<Control-v>', lambda e: paste_with_format())
-
-# Button to open a MusicXML, MSCX, or MSCZ file
-open_button = tk.Button(root, text="Open a MusicXML/MSCX/MSCZ File", command=load_musicxml)
-open_button.pack(pady=10)
-
-# Label to display the opened file name
-file_label = tk.Label(root, text="No file opened")
-file_label.pack(pady=5)
-
-# Ajouter un label pour la sélection des notes
-selection_label = tk.Label(root, padx=0, pady=10, text="Selected Notes: None")
-selection_label.place(x=0, y=50)
-
-# Buttons to Apply Color to Text
-green_button = tk.Button(root, text=" ", bg="green", command=lambda: change_color("green"))
-green_button.place(x=850, y=50, width=25)
-
-red_button = tk.Button(root, text=" ", bg="red", command=lambda: change_color("red"))
-red_button.place(x=875, y=50, width=25)
-
-blue_button = tk.Button(root, text=" ", bg="blue", command=lambda: change_color("blue"))
-blue_button.place(x=900, y=50, width=25)
-
-brown_button = tk.Button(root, text=" ", bg="brown", command=lambda: change_color("brown"))
-brown_button.place(x=925, y=50, width=25)
-
-
-# Add Legend for E String
-legend_label = tk.Label(root, text="E String:")
-legend_label.place(x=900, y=20)
-# Apply legend
-legend_colors = ['white', 'gray', 'brown', 'purple', 'pink', 'turquoise', 'blue']
-for i, color in enumerate(legend_colors, start=1):
-    legend_label = tk.Label(root, text=f"[{i}]", bg=color, fg='black' if color == 'white' else ('white' if color != 'turquoise' else 'black'))
-    legend_label.place(x=945 + (i * 30), y=20)
+        set_instrument(args.instrument, args.tuning)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    set_musicxml_engine(args.engine)
+    set_fingering_mode(args.fingering)
+    core.OPTIMIZER_PHRASE_MEASURES = args.phrase_measures
+    load_profiler = args.profile
+    if args.paths:
+        sys.exit(run_batch(args))
+
+    # Set up GUI components
+    root = tk.Tk()
+    root.title("MusicXML Note & Fingering Display")
+    root.geometry("1200x600")  # Set window size
+    root.bind('<Control-c>', lambda e: copy_with_format())
+    root.bind('<Control-v>', lambda e: paste_with_format())
+    root.bind('<F12>', lambda e: toggle_debug_panel())
+    root.protocol("WM_DELETE_WINDOW", close_window)
+
+    # Button to open a MusicXML, MSCX, or MSCZ file
+    open_button = tk.Button(root, text="Open a MusicXML/MSCX/MSCZ File", command=load_musicxml)
+    open_button.pack(pady=10)
+
+    # MusicXML reader selection
+    engine_label = tk.Label(root, text="MusicXML reader:")
+    engine_label.place(x=0, y=15)
+    engine_combobox = ttk.Combobox(root, values=MUSICXML_ENGINES, state='readonly', width=8)
+    engine_combobox.set(core.musicxml_engine)
+    engine_combobox.place(x=105, y=15)
+    engine_combobox.bind('<<ComboboxSelected>>', lambda e: set_musicxml_engine(engine_combobox.get()))
+
+    # Progress of the file being loaded, shown only while loading
+    progress_bar = ttk.Progressbar(root, mode='indeterminate', length=150)
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_load)
+
+    # Label to display the opened file name
+    file_label = tk.Label(root, text="No file opened")
+    file_label.pack(pady=5)
+
+    # Toolbar of the options (instrument, watch), packed under the file name: the placed loading
+    # controls (progress bar, Cancel) stay visible
+    options_frame = tk.Frame(root)
+    options_frame.pack()
+
+    # Instrument choice
+    instrument_label = tk.Label(options_frame, text="Instrument:")
+    instrument_label.pack(side=tk.LEFT)
+    instrument_combobox = ttk.Combobox(options_frame, values=list(INSTRUMENTS), state='readonly', width=6)
+    instrument_combobox.set(core.instrument)
+    instrument_combobox.pack(side=tk.LEFT, padx=(0, 10))
+    instrument_combobox.bind('<<ComboboxSelected>>', lambda e: change_instrument(instrument_combobox.get()))
+
+    # Watch the opened file for saves
+    watch_var = tk.BooleanVar(value=args.watch)
+    watch_checkbutton = tk.Checkbutton(options_frame, text="Watch file", variable=watch_var,
+                                       command=lambda: set_watch_enabled(watch_var.get()))
+    watch_checkbutton.pack(side=tk.LEFT)
+    set_watch_enabled(args.watch)
+
+    # Ajouter un label pour la sélection des notes
+    selection_label = tk.Label(root, padx=0, pady=10, text="Selected Notes: None")
+    selection_label.place(x=0, y=50)
+
+    # Buttons to Apply Color to Text
+    green_button = tk.Button(root, text=" ", bg="green", command=lambda: change_color("green"))
+    green_button.place(x=850, y=50, width=25)
+
+    red_button = tk.Button(root, text=" ", bg="red", command=lambda: change_color("red"))
+    red_button.place(x=875, y=50, width=25)
+
+    blue_button = tk.Button(root, text=" ", bg="blue", command=lambda: change_color("blue"))
+    blue_button.place(x=900, y=50, width=25)
+
+    brown_button = tk.Button(root, text=" ", bg="brown", command=lambda: change_color("brown"))
+    brown_button.place(x=925, y=50, width=25)
+
+
+    # Add Legend for E String (the highest string of the instrument)
+    string_legend_label = tk.Label(root, text=f"{core.instrument_strings[-1]}:")
+    string_legend_label.place(x=900, y=20)
+    # Apply legend
+    legend_colors = ['white', 'gray', 'brown', 'purple', 'pink', 'turquoise', 'blue']
+    for i, color in enumerate(legend_colors, start=1):
+        legend_label = tk.Label(root, text=f"[{i}]", bg=color, fg='black' if color == 'white' else ('white' if color != 'turquoise' else 'black'))
+        legend_label.place(x=945 + (i * 30), y=20)
    
 
-# Open in MuseScore
-musescore_button = tk.Button(root, text="Open in MuseScore", command=open_in_musescore)
-if check_musescore_path():
-    musescore_button.place(x=1010, y=50)
-
-# ScrolledText for original notes display
-original_notes_display = ScrolledText(root, width=50, height=10)
-original_notes_display.pack(pady=10, side=tk.LEFT, fill=tk.BOTH, expand=True)
-original_notes_display.insert(tk.END, "Original Notes:\n")
-original_notes_display.bind('<<Selection>>', highlight_selection)
-
-# ScrolledText for converted notes display
-converted_notes_display = ScrolledText(root, width=50, height=10)
-converted_notes_display.pack(pady=10, side=tk.LEFT, fill=tk.BOTH, expand=True)
-converted_notes_display.insert(tk.END, "Converted Violin Notes:\n")
-converted_notes_display.bind('<<Selection>>', highlight_selection)
-
-# ScrolledText for editable notes display
-editable_notes_display = ScrolledText(root, width=50, height=10)
-editable_notes_display.pack(pady=10, side=tk.RIGHT, fill=tk.BOTH, expand=True)
-editable_notes_display.insert(tk.END, "Editable Notes:\n")
-editable_notes_display.bind('<<Selection>>', highlight_selection)
-editable_notes_display.bind('<Return>', on_edit)
-root.bind('<Control-c>', lambda e: copy_with_format())
-
-
-root.mainloop()
+    # Open in MuseScore
+    musescore_button = tk.Button(root, text="Open in MuseScore", command=open_in_musescore)
+    if check_musescore_path():
+        musescore_button.place(x=1010, y=50)
+
+    # ScrolledText for original notes display
+    original_notes_display = ScrolledText(root, width=50, height=10)
+    original_notes_display.pack(pady=10, side=tk.LEFT, fill=tk.BOTH, expand=True)
+    original_notes_display.insert(tk.END, "Original Notes:\n")
+    original_notes_display.bind('<<Selection>>', highlight_selection)
+    original_notes_display.bind('<KeyRelease>', on_text_key)
+
+    # ScrolledText for converted notes display
+    converted_notes_display = ScrolledText(root, width=50, height=10)
+    converted_notes_display.pack(pady=10, side=tk.LEFT, fill=tk.BOTH, expand=True)
+    converted_notes_display.insert(tk.END, "Converted Violin Notes:\n")
+    converted_notes_display.bind('<<Selection>>', highlight_selection)
+    converted_notes_display.bind('<KeyRelease>', on_text_key)
+
+    # ScrolledText for editable notes display
+    editable_notes_display = ScrolledText(root, width=50, height=10)
+    editable_notes_display.pack(pady=10, side=tk.RIGHT, fill=tk.BOTH, expand=True)
+    editable_notes_display.insert(tk.END, "Editable Notes:\n")
+    editable_notes_display.bind('<<Selection>>', highlight_selection)
+    editable_notes_display.bind('<<Modified>>', on_edit)
+    editable_notes_display.bind('<KeyPress>', on_edit_press)
+    editable_notes_display.bind('<ButtonPress-1>', on_edit_press)
+    editable_notes_display.bind('<ButtonPress-2>', on_edit_press)
+    editable_notes_display.bind('<Button-3>', show_fingering_menu)
+    for text_widget in [original_notes_display, converted_notes_display, editable_notes_display]:
+        configure_palette(text_widget)
+        text_widget.configure(yscrollcommand=lambda first, last, w=text_widget: on_text_scroll(w, first, last))
+
+    # Lazy rendering of long scores
+    lazy_rendering_var = tk.BooleanVar(value=lazy_rendering)
+    lazy_checkbutton = tk.Checkbutton(root, text="Lazy display", variable=lazy_rendering_var,
+                                      command=lambda: set_lazy_rendering(lazy_rendering_var.get()))
+    lazy_checkbutton.place(x=730, y=13)
+
+    # Fingering choice
+    fingering_label = tk.Label(root, text="Fingering:")
+    fingering_label.place(x=680, y=53)
+    fingering_combobox = ttk.Combobox(root, values=FINGERING_MODES, state='readonly', width=9)
+    fingering_combobox.set(core.fingering_mode)
+    fingering_combobox.place(x=745, y=53)
+    fingering_combobox.bind('<<ComboboxSelected>>', lambda e: change_fingering_mode(fingering_combobox.get()))
+
+
+    root.mainloop()
@@ -0,0 +1,309 @@
+# Benchmark of every stage of the converter on synthetic scores.
+#
+#   python benchmark.py --measures 10 1000 20000 --output results.json
+#   python benchmark.py --measures 1000 --compare results.json
+#
+# Each stage is timed and its peak memory recorded with tracemalloc; the results are written
+# as JSON so two runs can be compared. The stages using Tk run against a hidden window, through
+# the functions of the window: open_score (worker thread, poll_load_job), convert_to_violin
+# (instrument or fingering change) and autosave.
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from types import SimpleNamespace
+
+import tkinter as tk
+from tkinter import ttk
+from tkinter.scrolledtext import ScrolledText
+
+import converter_core as core
+import MuseScoreToViolinConverter as app
+
+STAGES = ['parse_mscx', 'parse_mscz', 'read_musicxml', 'music21_parse', 'convert_greedy', 'convert_optimized',
+          'load_worker', 'load', 'load_cached', 'convert_to_violin', 'autosave', 'html_reimport', 'sidecar_reimport',
+          'highlight_selection']
+TK_STAGES = {'load', 'load_cached', 'convert_to_violin', 'autosave', 'html_reimport', 'sidecar_reimport',
+             'highlight_selection'}
+
+# Calls of highlight_selection timed together, the result is per call
+HIGHLIGHT_CALLS = 100
+
+STEPS = ['C', 'C', 'D', 'D', 'E', 'F', 'F', 'G', 'G', 'A', 'A', 'B']
+ALTERS = [0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0]
+
+# Synthetic music: per staff and per measure, 4 quarter beats of single notes or chords.
+# Pitches go a little outside the violin range so every kind of note is converted.
+def synthetic_measures(measure_count, staves, chord_ratio, seed):
+    generator = random.Random(seed)
+    music = []
+    for staff in range(staves):
+        measures = []
+        pitch = 67
+        for _ in range(measure_count):
+            beats = []
+            for _ in range(4):
+                pitch = min(max(pitch + generator.randint(-4, 4), 50), 95)
+                chord = [pitch]
+                if generator.random() < chord_ratio:
+                    chord += [pitch + 4, pitch + 7][:generator.randint(1, 2)]
+                beats.append(chord)
+            measures.append(beats)
+        music.append(measures)
+    return music
+
+def write_mscx(path, music):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<museScore version="3.02">\n<Score>\n')
+        for staff, measures in enumerate(music, start=1):
+            f.write(f'<Staff id="{staff}">\n')
+            for beats in measures:
+                f.write('<Measure><voice>')
+                for chord in beats:
+                    f.write('<Chord><durationType>quarter</durationType>')
+                    for pitch in chord:
+                        f.write(f'<Note><pitch>{pitch}</pitch></Note>')
+                    f.write('</Chord>')
+                f.write('</voice></Measure>\n')
+            f.write('</Staff>\n')
+        f.write('</Score>\n</museScore>\n')
+
+def write_mscz(path, mscx_path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.write(mscx_path, 'score.mscx')
+        zip_ref.writestr('META-INF/container.xml',
+                         '<container><rootfiles><rootfile full-path="score.mscx"/></rootfiles></container>')
+
+# One part with a staff per synthetic staff, like a piano score
+def write_musicxml(path, music):
+    staves = len(music)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<score-partwise version="3.1">\n'
+                '<part-list><score-part id="P1"><part-name>Synthetic</part-name></score-part></part-list>\n'
+                '<part id="P1">\n')
+        for i in range(len(music[0])):
+            f.write(f'<measure number="{i + 1}">')
+            if i == 0:
+                clefs = ''.join(f'<clef number="{staff}"><sign>G</sign><line>2</line></clef>'
+                                for staff in range(1, staves + 1))
+                f.write(f'<attributes><divisions>1</divisions><time><beats>4</beats><beat-type>4</beat-type></time>'
+                        f'<staves>{staves}</staves>{clefs}</attributes>')
+            for staff, measures in enumerate(music, start=1):
+                if staff > 1:
+                    f.write('<backup><duration>4</duration></backup>')
+                for chord in measures[i]:
+                    for k, pitch in enumerate(chord):
+                        octave, semitone = divmod(pitch, 12)
+                        alter = f'<alter>{ALTERS[semitone]}</alter>' if ALTERS[semitone] else ''
+                        f.write(f'<note>{"<chord/>" if k else ""}<pitch><step>{STEPS[semitone]}</step>{alter}'
+                                f'<octave>{octave - 1}</octave></pitch><duration>1</duration>'
+                                f'<voice>{staff}</voice><type>quarter</type><staff>{staff}</staff></note>')
+            f.write('</measure>\n')
+        f.write('</part>\n</score-partwise>\n')
+
+# Time a function and record its peak memory
+def measure_stage(function, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_bytes': peak}
+
+# The Textboxes and labels of the window, in a root that is never shown
+def create_hidden_window():
+    root = tk.Tk()
+    root.withdraw()
+    app.root = root
+    for name in ['original_notes_display', 'converted_notes_display', 'editable_notes_display']:
+        text_widget = ScrolledText(root, width=50, height=10)
+        text_widget.pack()
+        app.configure_palette(text_widget)
+        setattr(app, name, text_widget)
+    app.file_label = tk.Label(root)
+    app.selection_label = tk.Label(root)
+    app.progress_bar = ttk.Progressbar(root, mode='indeterminate')
+    app.cancel_button = tk.Button(root)
+    # A hidden window has no height: render every line
+    app.lazy_rendering = False
+    return root
+
+# Load of the worker thread alone, without the window: every batch is read from its queue
+def run_load_worker(path):
+    job = app.LoadJob(path)
+    app.load_worker(job)
+    results = []
+    while not job.results.empty():
+        results.append(job.results.get_nowait())
+    if results[-1][0] == 'error':
+        raise results[-1][1]
+    return results
+
+# Open a score like the Open button and run the Tk event loop until it is shown
+def open_score(root, path):
+    job = app.open_score(path)
+    while app.current_load_job is job:
+        root.update()
+        time.sleep(0.001)
+    if app.loaded_file_path != path:
+        raise Exception(f"Loading {path} failed")
+
+# Autosave of the whole editable Textbox, until the files are written by its thread
+def autosave():
+    app.full_save_needed = True
+    app.autosave()
+    app.autosave_executor.submit(lambda: None).result()
+
+def highlight_middle_line():
+    widget = app.editable_notes_display
+    line = max(1, int(widget.index('end-1c').split('.')[0]) // 2)
+    widget.tag_remove(tk.SEL, '1.0', tk.END)
+    widget.tag_add(tk.SEL, f"{line}.8", f"{line}.14")
+    event = SimpleNamespace(widget=widget)
+    for _ in range(HIGHLIGHT_CALLS):
+        app.highlight_selection(event)
+
+# Run the stages on scores of measure_count measures and return their results
+def run_size(measure_count, args, directory, root):
+    music = synthetic_measures(measure_count, args.staves, args.chord_ratio, args.seed)
+    base = os.path.join(directory, f"synthetic_{measure_count}")
+    mscx_path, mscz_path, musicxml_path = base + '.mscx', base + '.mscz', base + '.musicxml'
+    write_mscx(mscx_path, music)
+    write_mscz(mscz_path, mscx_path)
+    write_musicxml(musicxml_path, music)
+
+    stages = {}
+    skipped = set(args.skip)
+    if root is None:
+        skipped |= TK_STAGES
+
+    def run(stage, function):
+        if stage in skipped:
+            return None
+        result, stages[stage] = measure_stage(function, not args.no_memory)
+        print(f"  {stage:20s} {stages[stage]['seconds']:9.4f}s"
+              + (f"  {stages[stage]['peak_bytes'] / 2**20:9.1f} MB" if stages[stage]['peak_bytes'] is not None else ''))
+        return result
+
+    # The readers used by the load
+    def read(path, engine=None):
+        return core.NoteEvents.from_measures(core.iter_measures(path, engine))
+
+    measures = run('parse_mscx', lambda: read(mscx_path))
+    run('parse_mscz', lambda: read(mscz_path))
+    run('read_musicxml', lambda: read(musicxml_path, 'native'))
+    run('music21_parse', lambda: read(musicxml_path, 'music21'))
+    if measures is None:
+        measures = read(mscx_path)
+    run('convert_greedy', lambda: core.convert_measures(measures, 'greedy'))
+    run('convert_optimized', lambda: core.convert_measures(measures, 'optimized'))
+
+    # Loads start from an empty cache, then read the score from it
+    cache_directory = os.path.join(directory, 'cache')
+    core.cache_directory = cache_directory
+    run('load_worker', lambda: run_load_worker(mscx_path))
+    shutil.rmtree(cache_directory, ignore_errors=True)
+    run('load', lambda: open_score(root, mscx_path))
+    run('load_cached', lambda: open_score(root, mscx_path))
+    if root is not None and 'load' in skipped and 'load_cached' in skipped:
+        open_score(root, mscx_path)
+    run('convert_to_violin', app.convert_to_violin)
+    run('autosave', autosave)
+    if os.path.exists(core.get_sidecar_path(mscx_path)):
+        run('html_reimport', lambda: app.show_html_lines(*core.read_html_lines(core.get_html_path(mscx_path))))
+        run('sidecar_reimport', lambda: app.show_sidecar_lines(*core.read_sidecar(core.get_sidecar_path(mscx_path))))
+    run('highlight_selection', highlight_middle_line)
+    if 'highlight_selection' in stages:
+        stages['highlight_selection']['seconds'] /= HIGHLIGHT_CALLS
+
+    return {
+        'measures': measure_count,
+        'notes': sum(len(chord) for measures in music for beats in measures for chord in beats),
+        'file_bytes': {'mscx': os.path.getsize(mscx_path), 'mscz': os.path.getsize(mscz_path),
+                       'musicxml': os.path.getsize(musicxml_path)},
+        'stages': stages,
+    }
+
+# Print the ratio of each stage time to a previous run, and whether it is a regression
+def compare_runs(previous, current, threshold):
+    previous_runs = {run['measures']: run for run in previous['runs']}
+    regressions = 0
+    for run in current['runs']:
+        old_run = previous_runs.get(run['measures'])
+        if not old_run:
+            continue
+        print(f"{run['measures']} measures, compared to the previous run:")
+        for stage, result in run['stages'].items():
+            old = old_run['stages'].get(stage)
+            if not old or not old['seconds']:
+                continue
+            ratio = result['seconds'] / old['seconds']
+            regression = ratio > threshold
+            regressions += regression
+            print(f"  {stage:20s} x{ratio:6.2f}{'  REGRESSION' if regression else ''}")
+    return regressions
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Time every stage of the converter on synthetic scores")
+    parser.add_argument('--measures', type=int, nargs='+', default=[10, 1000],
+                        help="Score sizes in measures per staff (default: 10 1000)")
+    parser.add_argument('--staves', type=int, default=2, help="Staves of the synthetic scores (default: 2)")
+    parser.add_argument('--chord-ratio', type=float, default=0.2,
+                        help="Part of the beats played as chords (default: 0.2)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip', nargs='+', default=[], choices=STAGES, help="Stages not to run")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Don't trace the memory (tracemalloc slows the stages down)")
+    parser.add_argument('-o', '--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Previous JSON results to compare with")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression by --compare (default: 1.2)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    try:
+        root = create_hidden_window()
+    except tk.TclError as e:
+        print(f"No display, the Tk stages are skipped: {e}")
+        root = None
+
+    results = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'staves': args.staves,
+        'chord_ratio': args.chord_ratio,
+        'memory_traced': not args.no_memory,
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for measure_count in args.measures:
+            print(f"{measure_count} measures x {args.staves} staves")
+            results['runs'].append(run_size(measure_count, args, directory, root))
+    if root is not None:
+        root.destroy()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        return 1 if compare_runs(previous, results, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1418 @@
+# GUI-free core of the converter: reading MSCX, MSCZ and MusicXML scores, violin fingering,
+# cache of converted scores, HTML and sidecar export, batch conversion.
+# music21, BeautifulSoup and NumPy are imported by the functions that need them, so importing
+# this module (and starting the window) doesn't pay for them.
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+import zipfile
+import itertools
+import difflib
+import os
+import json
+import re
+import time
+import threading
+import html
+import hashlib
+import zlib
+import base64
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# MusicXML readers: 'native' reads the XML directly, 'music21' builds the whole music21 score,
+# 'auto' uses the native reader and falls back to music21 for what it can't handle
+MUSICXML_ENGINES = ('auto', 'native', 'music21')
+musicxml_engine = 'auto'
+
+# Change the MusicXML reader used for the next files
+def set_musicxml_engine(engine):
+    global musicxml_engine
+    musicxml_engine = engine
+
+# Number of measures converted at once, and rendered per Tk callback while a file is loading
+MEASURES_PER_BATCH = 50
+
+# Function to read an exported HTML file: lines of (text, classes) and the CSS rule of each class
+def read_html_lines(html_path):
+    with open(html_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    body_content = soup.find('body')
+    if not body_content:
+        return None
+
+    # CSS rule of each class, to map the classes onto the palette
+    style_content = soup.find('style')
+    class_styles = dict(re.findall(r'(?<![^\s}])\.([^\s{]+)\s*\{([^}]*)\}',
+                                   style_content.get_text() if style_content else ''))
+    lines = []
+    for line in body_content.find_all('div', class_='measure'):
+        runs = []
+        for element in line:
+            if element.name == 'span':
+                runs.append((element.get_text(), element.get('class', [])))
+            else:
+                runs.append((str(element), []))
+        lines.append(runs)
+    return lines, class_styles
+
+# Sidecar file with the user's fingering: for each line, its text and its (start, end, tag) ranges.
+# It is what the editor reads back; the HTML file is only an export.
+SIDECAR_VERSION = 1
+
+def get_sidecar_path(file_path, parts=None):
+    directory = os.path.dirname(file_path)
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(directory, f"{base_name}{parts_suffix(parts)}_fingering.json")
+
+# Suffix of the files saved for a selection of parts, so each selection keeps its own edits.
+# The whole score has none: files written before parts could be chosen keep their name.
+def parts_suffix(parts):
+    if parts is None:
+        return ''
+    return '_parts-' + hashlib.sha1(repr(part_keys(parts)).encode('utf-8')).hexdigest()[:8]
+
+# Function to read a sidecar file: line records and the style of each tag.
+# None if it was saved for another selection of parts (part_keys) than parts.
+def read_sidecar(sidecar_path, parts=None):
+    with open(sidecar_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != SIDECAR_VERSION:
+        raise Exception(f"Unknown version of {os.path.basename(sidecar_path)}")
+    if data.get('parts') != part_keys(parts):
+        return None
+    lines = [(text, [tuple(tag_range) for tag_range in ranges]) for text, ranges in data['lines']]
+    return lines, data.get('styles', {})
+
+# Function to get the JSON of one line record, as written in the sidecar file
+def sidecar_line_fragment(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+# Build the sidecar document from the styles and the JSON fragment of each line
+def sidecar_document(styles, fragments, parts=None):
+    return ''.join(['{"version":', str(SIDECAR_VERSION),
+                    ',"parts":', json.dumps(part_keys(parts), ensure_ascii=False),
+                    ',"styles":', json.dumps(styles, ensure_ascii=False, separators=(',', ':')),
+                    ',"lines":[\n', ',\n'.join(fragments), '\n]}\n'])
+
+# Compact model of the notes of a score: one entry per note in typed arrays instead of a string
+# or a music21 object per note. Readers yield each measure as a list of note tuples
+# (pitch, alter, duration, voice, staff, chord), which NoteEvents packs into its arrays.
+NOTE_FIELDS = ('pitch', 'alter', 'duration', 'voice', 'staff', 'chord')
+NOTE_TYPECODES = {'pitch': 'h', 'alter': 'b', 'duration': 'f', 'measure': 'i', 'voice': 'b', 'staff': 'h',
+                  'chord': 'h', 'measure_starts': 'i'}
+
+class NoteEvents:
+    # pitch: MIDI number (-1 when it can't be read), alter: spelling of the pitch (-2 to 2, C#4 or D-4),
+    # duration: quarter lengths, measure: from 0, voice and staff: from 1,
+    # chord: number of the chord in its measure, the notes sounding together share it.
+    # measure_starts: index of the first note of each measure (a measure may be empty)
+    __slots__ = tuple(NOTE_TYPECODES)
+
+    def __init__(self):
+        for field, typecode in NOTE_TYPECODES.items():
+            setattr(self, field, array(typecode))
+
+    # Build the model from the measures yielded by a reader
+    @classmethod
+    def from_measures(cls, measures):
+        events = cls()
+        for notes in measures:
+            events.add_measure(notes)
+        return events
+
+    def __len__(self):
+        return len(self.pitch)
+
+    def measure_count(self):
+        return len(self.measure_starts)
+
+    def add_measure(self, notes):
+        measure = len(self.measure_starts)
+        self.measure_starts.append(len(self.pitch))
+        for pitch, alter, duration, voice, staff, chord in notes:
+            self.pitch.append(pitch)
+            self.alter.append(alter)
+            self.duration.append(duration)
+            self.measure.append(measure)
+            self.voice.append(voice)
+            self.staff.append(staff)
+            self.chord.append(chord)
+
+    # Append the measures of another model after the ones of this one
+    def extend(self, other):
+        note_offset, measure_offset = len(self.pitch), len(self.measure_starts)
+        for field in NOTE_FIELDS:
+            getattr(self, field).extend(getattr(other, field))
+        self.measure.extend(array('i', [measure + measure_offset for measure in other.measure]))
+        self.measure_starts.extend(array('i', [start + note_offset for start in other.measure_starts]))
+
+    # Index of the first and after the last note of a measure
+    def note_range(self, measure):
+        start = self.measure_starts[measure]
+        end = self.measure_starts[measure + 1] if measure + 1 < len(self.measure_starts) else len(self.pitch)
+        return start, end
+
+    # New model with the measures from first to last (excluded), numbered from 0
+    def measure_slice(self, first, last):
+        last = min(last, len(self.measure_starts))
+        events = NoteEvents()
+        if first >= last:
+            return events
+        start, end = self.note_range(first)[0], self.note_range(last - 1)[1]
+        for field in NOTE_FIELDS:
+            setattr(events, field, getattr(self, field)[start:end])
+        events.measure = array('i', [measure - first for measure in self.measure[start:end]])
+        events.measure_starts = array('i', [note - start for note in self.measure_starts[first:last]])
+        return events
+
+    # Note names of a measure, as the Textboxes show them
+    def measure_note_names(self, measure):
+        start, end = self.note_range(measure)
+        return [note_name(pitch, alter) for pitch, alter in zip(self.pitch[start:end], self.alter[start:end])]
+
+    # The measures as note tuples, like a reader yields them
+    def iter_measures(self):
+        columns = [getattr(self, field) for field in NOTE_FIELDS]
+        for measure in range(len(self.measure_starts)):
+            start, end = self.note_range(measure)
+            yield list(zip(*(column[start:end] for column in columns)))
+
+    # Content hash of the notes of each measure (not of its number), to find the measures
+    # changed between two readings of a score
+    def measure_hashes(self):
+        columns = [getattr(self, field) for field in NOTE_FIELDS]
+        hashes = []
+        for measure in range(len(self.measure_starts)):
+            start, end = self.note_range(measure)
+            digest = hashlib.blake2b(digest_size=16)
+            for column in columns:
+                digest.update(column[start:end].tobytes())
+            hashes.append(digest.digest())
+        return hashes
+
+    # Arrays as base64 text, for the cache
+    def to_record(self):
+        return {field: base64.b64encode(getattr(self, field).tobytes()).decode('ascii') for field in NOTE_TYPECODES}
+
+    @classmethod
+    def from_record(cls, record):
+        events = cls()
+        for field in NOTE_TYPECODES:
+            getattr(events, field).frombytes(base64.b64decode(record[field]))
+        return events
+
+# Function to write a note from its MIDI number and spelling (C#4, E-5...), "?" when it couldn't be read
+@lru_cache(maxsize=None)
+def note_name(pitch, alter=0):
+    if pitch < 0 or alter not in ALTER_ACCIDENTALS:
+        return "?"
+    octave, semitone = divmod(pitch - alter, 12)
+    step = NATURAL_STEPS.get(semitone)
+    if step is None:
+        return "?"
+    return f"{step}{ALTER_ACCIDENTALS[alter]}{octave - 1}"
+
+# Written durations of MuseScore, in quarter lengths
+DURATION_TYPES = {'longa': 16.0, 'breve': 8.0, 'whole': 4.0, 'half': 2.0, 'quarter': 1.0, 'eighth': 0.5,
+                  '16th': 0.25, '32nd': 0.125, '64th': 0.0625, '128th': 0.03125, '256th': 0.015625}
+
+# Function to get the notes of one <Measure> element of the staff staff_id.
+# Black keys are spelled with a sharp (C#4), MuseScore only gives the MIDI number.
+def measure_notes(measure, staff_id):
+    notes = []
+    chord_number = 0
+    # MuseScore 2 files have no <voice>: the chords are in the measure
+    for voice_number, voice in enumerate(measure.findall('voice') or [measure], start=1):
+        for chord in voice.iter('Chord'):
+            duration = DURATION_TYPES.get(chord.findtext('durationType'), 0.0)
+            dots = int(chord.findtext('dots', '0') or 0)
+            duration *= 2 - 0.5 ** dots
+            for note_elem in chord.iter('Note'):
+                pitch_elem = note_elem.find(".//pitch")
+                if pitch_elem is not None and pitch_elem.text is not None:
+                    try:
+                        midi_number = int(pitch_elem.text)
+                    except ValueError:
+                        midi_number = -1
+                    alter = 1 if midi_number >= 0 and midi_number % 12 in SHARP_SEMITONES else 0
+                    notes.append((midi_number, alter, duration, voice_number, staff_id, chord_number))
+            chord_number += 1
+    return notes
+
+# Generator yielding the notes of each measure of an MSCX file (path or file object).
+# Measures are read incrementally and dropped once yielded, so memory stays bounded.
+# With staff_ids, only the measures of these staves of the score (museScore/Score/Staff) are read.
+def iter_mscx_measures(source, staff_ids=None):
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == 'Measure':
+            staff_id = parents[-1].get('id') if len(parents) == 3 else None
+            if staff_ids is None or (len(parents) == 3 and staff_id in staff_ids):
+                notes = measure_notes(elem, int(staff_id) if staff_id and staff_id.isdigit() else 1)
+            else:
+                notes = []
+            # Detach the finished measure from the tree
+            if parents:
+                parents[-1].remove(elem)
+            elem.clear()
+            if notes:
+                yield notes
+
+# Function to list the MSCX files of an MSCZ archive: the score first, then the excerpts (parts)
+def mscz_score_files(zip_ref):
+    mscx_files = [f for f in zip_ref.namelist() if f.endswith('.mscx')]
+    if not mscx_files:
+        raise Exception("No .mscx file found in the .mscz archive")
+    return mscx_files
+
+# Generator reading an MSCX file of an MSCZ archive (the first one by default) straight from the zip
+def iter_mscz_measures(file_path, member=None, staff_ids=None):
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        with zip_ref.open(member or mscz_score_files(zip_ref)[0]) as mscx_file:
+            yield from iter_mscx_measures(mscx_file, staff_ids)
+
+# Generator yielding the notes of each measure of a music21 score (only the parts of part_ids if given)
+def iter_score_measures(score, part_ids=None):
+    from music21 import note, stream
+    for staff, part in enumerate(score.parts, start=1):
+        # music21 keeps the MusicXML part id in the id or, in recent versions, in the groups
+        if part_ids is not None and part.id not in part_ids and not set(part.groups) & set(part_ids):
+            continue
+        for measure in part.getElementsByClass(stream.Measure):
+            voices = {id(element): voice_number for voice_number, voice in enumerate(measure.voices, start=1)
+                      for element in voice.notes}
+            notes = []
+            for element in measure.flatten().notes:  # Use .flatten() instead of .flat
+                if isinstance(element, note.Note):
+                    accidental = element.pitch.accidental
+                    alter = int(accidental.alter) if accidental is not None and accidental.alter in ALTER_ACCIDENTALS else 0
+                    notes.append((element.pitch.midi, alter, float(element.quarterLength),
+                                  voices.get(id(element), 1), staff, len(notes)))
+            yield notes
+
+# Raised by the native MusicXML reader for files it doesn't handle
+class UnsupportedMusicXML(Exception):
+    pass
+
+# music21 spelling of the alterations (nameWithOctave)
+ALTER_ACCIDENTALS = {-2: '--', -1: '-', 0: '', 1: '#', 2: '##'}
+
+# Function to get the MusicXML file listed in the container of a compressed .mxl
+def mxl_root_file(zip_ref):
+    try:
+        container = ET.fromstring(zip_ref.read('META-INF/container.xml'))
+        rootfile = container.find('.//rootfile')
+        if rootfile is not None and rootfile.get('full-path'):
+            return rootfile.get('full-path')
+    except KeyError:
+        pass
+    xml_files = [f for f in zip_ref.namelist()
+                 if f.endswith(('.xml', '.musicxml')) and not f.startswith('META-INF/')]
+    if not xml_files:
+        raise Exception("No MusicXML file found in the .mxl archive")
+    return xml_files[0]
+
+# Function to get the notes of one <measure>, per staff, in the order music21 gives them:
+# sorted by offset, without rests, unpitched notes and chords. divisions: MusicXML durations per quarter
+def musicxml_measure_notes(measure, divisions=1):
+    events = []  # [offset, staff, (pitch, alter), in_chord, voice, duration]
+    offset = 0
+    last_offset = 0
+    for child in measure:
+        if child.tag == 'backup':
+            offset -= float(child.findtext('duration', '0'))
+        elif child.tag == 'forward':
+            offset += float(child.findtext('duration', '0'))
+        elif child.tag == 'note':
+            staff = int(child.findtext('staff', '1'))
+            voice = child.findtext('voice', '1')
+            duration = float(child.findtext('duration', '0'))
+            in_chord = child.find('chord') is not None
+            if in_chord:
+                # Chord notes share the offset of the previous note, which belongs to the chord too
+                if events:
+                    events[-1][3] = True
+                note_offset = last_offset
+            else:
+                note_offset = offset
+                if child.find('grace') is None:
+                    offset += duration
+            last_offset = note_offset
+
+            written = None
+            pitch = child.find('pitch')
+            if pitch is not None:
+                alter = float(pitch.findtext('alter', '0'))
+                if alter not in ALTER_ACCIDENTALS:
+                    raise UnsupportedMusicXML(f"Alteration {alter} is not handled by the native reader")
+                alter = int(alter)
+                midi = (int(pitch.findtext('octave')) + 1) * 12 + NOTE_STEPS[pitch.findtext('step')] + alter
+                written = (midi, alter)
+            events.append([note_offset, staff, written, in_chord, int(voice) if voice.isdigit() else 1,
+                           duration / divisions])
+
+    notes_by_staff = {}
+    for note_offset, staff, written, in_chord, voice, duration in sorted(events, key=lambda event: event[0]):
+        if written is not None and not in_chord:
+            notes = notes_by_staff.setdefault(staff, [])
+            notes.append((written[0], written[1], duration, voice, staff, len(notes)))
+    return notes_by_staff
+
+# Generator yielding the notes of each measure of a partwise MusicXML file.
+# Like music21, parts are given one after the other, and each staff of a part separately.
+# With part_ids, the measures of the other parts are skipped without being read.
+def iter_partwise_measures(source, part_ids=None):
+    parents = []
+    part_measures = []
+    staves = 1
+    divisions = 1
+    skipped_part = False
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if not parents and elem.tag != 'score-partwise':
+                raise UnsupportedMusicXML(f"<{elem.tag}> scores are not handled by the native reader")
+            if elem.tag == 'part':
+                part_measures = []
+                staves = 1
+                divisions = 1
+                skipped_part = part_ids is not None and elem.get('id') not in part_ids
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == 'measure':
+            if not skipped_part:
+                staves = max(staves, int(elem.findtext('attributes/staves', '1')))
+                divisions = float(elem.findtext('attributes/divisions') or divisions)
+                part_measures.append(musicxml_measure_notes(elem, divisions))
+            # Detach the finished measure from the tree
+            parents[-1].remove(elem)
+            elem.clear()
+        elif elem.tag == 'part':
+            for staff in range(1, staves + 1):
+                for notes_by_staff in part_measures:
+                    yield notes_by_staff.get(staff, [])
+            parents[-1].remove(elem)
+
+# Generator yielding the notes per measure of a .musicxml or compressed .mxl file
+def iter_musicxml_measures(file_path, part_ids=None):
+    if file_path.endswith('.mxl'):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            with zip_ref.open(mxl_root_file(zip_ref)) as xml_file:
+                yield from iter_partwise_measures(xml_file, part_ids)
+    else:
+        yield from iter_partwise_measures(file_path, part_ids)
+
+# Function to read the notes of a MusicXML file with the selected engine
+def read_musicxml_measures(file_path, engine=None, part_ids=None):
+    engine = engine or musicxml_engine
+    if engine != 'music21':
+        try:
+            return NoteEvents.from_measures(iter_musicxml_measures(file_path, part_ids))
+        except (UnsupportedMusicXML, ET.ParseError) as e:
+            if engine == 'native':
+                raise
+            print(f"Native MusicXML reader can't read {os.path.basename(file_path)} ({e}), using music21")
+    return NoteEvents.from_measures(iter_score_measures(parse_music21_score(file_path), part_ids))
+
+# Function to read a whole score with music21 (imported on first use, it takes a while)
+def parse_music21_score(file_path):
+    from music21 import converter
+    return converter.parse(file_path)
+
+# Generator yielding the notes per measure of any supported file (of the given parts only, if any)
+def iter_measures(file_path, engine=None, parts=None):
+    if parts is not None:
+        return itertools.chain.from_iterable(iter_part_measures(file_path, part, engine) for part in parts)
+    if file_path.endswith('.mscz'):
+        return iter_mscz_measures(file_path)
+    elif file_path.endswith('.mscx'):
+        return iter_mscx_measures(file_path)
+    else:
+        return read_musicxml_measures(file_path, engine).iter_measures()
+
+# Parts of a score, listed from the header without reading the music:
+# {'id', 'name', 'staves' (MSCX staff ids, None for MusicXML), 'source' (MSCZ member)}
+def list_parts(file_path):
+    if file_path.endswith('.mscz'):
+        parts = []
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            mscx_files = mscz_score_files(zip_ref)
+            for member in mscx_files:
+                with zip_ref.open(member) as mscx_file:
+                    member_parts = list_mscx_parts(mscx_file, member)
+                # Excerpts (the parts saved by MuseScore) are named after their file
+                if member != mscx_files[0]:
+                    excerpt = os.path.splitext(os.path.basename(member))[0]
+                    for part in member_parts:
+                        part['name'] = f"{part['name']} ({excerpt})"
+                parts.extend(member_parts)
+        return parts
+    elif file_path.endswith('.mscx'):
+        with open(file_path, 'rb') as mscx_file:
+            return list_mscx_parts(mscx_file)
+    elif file_path.endswith('.mxl'):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            with zip_ref.open(mxl_root_file(zip_ref)) as xml_file:
+                return list_musicxml_parts(xml_file)
+    else:
+        with open(file_path, 'rb') as xml_file:
+            return list_musicxml_parts(xml_file)
+
+# Function to read the <Part> elements of an MSCX file, which come before the music
+def list_mscx_parts(source, member=None):
+    parts = []
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            # The first staff of the score starts the music: nothing more to list
+            if elem.tag == 'Staff' and len(parents) == 2:
+                break
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == 'Part' and len(parents) == 2:
+            name = (elem.findtext('trackName') or elem.findtext('Instrument/longName') or '').strip()
+            parts.append({'id': str(len(parts) + 1), 'name': name or f"Part {len(parts) + 1}",
+                          'staves': [staff.get('id') for staff in elem.findall('Staff')], 'source': member})
+    return parts
+
+# Function to read the <part-list> of a MusicXML file, which comes before the music
+def list_musicxml_parts(source):
+    parts = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'part':
+                break
+        elif elem.tag == 'score-part':
+            name = (elem.findtext('part-name') or '').strip()
+            parts.append({'id': elem.get('id'), 'name': name or elem.get('id'), 'staves': None, 'source': None})
+    return parts
+
+# Generator yielding the notes per measure of one part: only its staves are read
+def iter_part_measures(file_path, part, engine=None):
+    if file_path.endswith('.mscz'):
+        return iter_mscz_measures(file_path, part['source'], part['staves'])
+    elif file_path.endswith('.mscx'):
+        return iter_mscx_measures(file_path, part['staves'])
+    else:
+        return read_musicxml_measures(file_path, engine, [part['id']]).iter_measures()
+
+# Violin parts, from their name (Violin I, Violino, Violon 2, Vln. 1...)
+VIOLIN_PART_PATTERN = re.compile(r'\b(violin[eoi]?s?|violinen|violons?|vln|vl|vn)\b', re.IGNORECASE)
+
+def violin_parts(parts):
+    return [part for part in parts if VIOLIN_PART_PATTERN.search(part['name'])]
+
+# Parts proposed by default: the violin parts of the score itself, else of its excerpts, else everything
+def default_parts(parts):
+    violins = violin_parts(parts)
+    main_violins = [part for part in violins if parts and part['source'] == parts[0]['source']]
+    return main_violins or violins or parts
+
+# Identifier of a part in a command line selection: its id in the score itself, "<excerpt>#<id>"
+# in an MSCZ excerpt (the ids of each excerpt restart at 1)
+def part_selection_id(part, parts):
+    if part['source'] == parts[0]['source']:
+        return part['id']
+    return f"{os.path.splitext(os.path.basename(part['source']))[0]}#{part['id']}"
+
+# Function to pick parts from a command line selection: 'all' (the whole file, None),
+# 'violin' (default_parts), or comma-separated part names or ids
+def select_parts(parts, selection):
+    if selection in (None, 'all'):
+        return None
+    if selection == 'violin':
+        return default_parts(parts) if parts else None
+    wanted = [name.strip().lower() for name in selection.split(',') if name.strip()]
+    selected = [part for part in parts
+                if part['name'].lower() in wanted or part_selection_id(part, parts).lower() in wanted]
+    if not selected:
+        available = ', '.join(f"{part['name']} [{part_selection_id(part, parts)}]" for part in parts)
+        raise Exception(f"No part named {selection} (parts: {available})")
+    return selected
+
+# Identifiers of a part selection, for the cache key and the sidecar file
+def part_keys(parts):
+    if parts is None:
+        return None
+    return [f"{part['source'] or ''}#{part['id']}" for part in parts]
+
+# Function to read and convert one part, in a worker process: (NoteEvents, fingerings)
+def convert_part(file_path, part, engine=None, mode=None, phrase_measures=None, instrument=None):
+    measures, fingerings = NoteEvents(), []
+    for batch in measure_batches(iter_part_measures(file_path, part, engine), mode, phrase_measures):
+        measures.extend(batch)
+        fingerings.extend(convert_measures(batch, mode, instrument))
+    return measures, fingerings
+
+# Generator converting the parts concurrently with an executor (one after the other without),
+# yielding (measures, fingerings) per part in the order of parts
+def convert_parts(file_path, parts, engine=None, mode=None, phrase_measures=None, executor=None, instrument=None):
+    # Worker processes don't share the settings of this one
+    engine = engine or musicxml_engine
+    mode = mode or fingering_mode
+    phrase_measures = OPTIMIZER_PHRASE_MEASURES if phrase_measures is None else phrase_measures
+    instrument = instrument or current_instrument()
+    if executor is None:
+        for part in parts:
+            yield convert_part(file_path, part, engine, mode, phrase_measures, instrument)
+        return
+    futures = [executor.submit(convert_part, file_path, part, engine, mode, phrase_measures, instrument)
+               for part in parts]
+    for future in futures:
+        yield future.result()
+
+# Associate colors string (ColourStrings Method)
+string_colors = {
+    'G String': 'green',   # for G
+    'D String': 'red',     # Red for D
+    'A String': 'blue',    # Blue for A
+    'E String': 'brown',   # Brown instead of Yellow because can't see nothing for E
+    'C String': 'purple'   # Viola and cello
+}
+# Update Positions Colors
+position_colors = {
+    '1': {'background': 'white', 'foreground': 'black'},
+    '2': {'background': 'gray', 'foreground': 'white'},
+    '3': {'background': 'brown', 'foreground': 'white'},
+    '4': {'background': 'purple', 'foreground': 'white'},
+    '5': {'background': 'pink', 'foreground': 'white'},
+    '6': {'background': 'turquoise', 'foreground': 'black'},
+    '7': {'background': 'blue', 'foreground': 'white'},
+}
+
+# Note names as written by note_name or music21 (C#4, Bb3, E-4...)
+NOTE_NAME_PATTERN = re.compile(r'^([A-G])([#b-]*)(-?\d+)$')
+NOTE_STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+NATURAL_STEPS = {semitone: step for step, semitone in NOTE_STEPS.items()}
+SHARP_SEMITONES = {1, 3, 6, 8, 10}
+
+# Function to convert a note name to its MIDI number (None if it can't be read)
+@lru_cache(maxsize=None)
+def note_name_to_midi(note_name):
+    match = NOTE_NAME_PATTERN.match(note_name)
+    if not match:
+        return None
+    step, accidentals, octave = match.groups()
+    alter = accidentals.count('#') - accidentals.count('b') - accidentals.count('-')
+    return (int(octave) + 1) * 12 + NOTE_STEPS[step] + alter
+
+def finger_number(finger):
+    return int(finger.strip(LOWERED + RAISED))
+
+# Instruments as tuning descriptions, compiled into their fingering tables: strings from the lowest
+# (name, open note), number of positions, spacing of the 4 fingers in a position (semitones above
+# the 1st finger) and highest note written for the instrument (None: the highest one of the tables)
+INSTRUMENTS = {
+    'violin': {'strings': (('G String', 'G3'), ('D String', 'D4'), ('A String', 'A4'), ('E String', 'E5')),
+               'positions': 7, 'spacing': (0, 2, 3, 5), 'highest': 'E6'},
+    'viola': {'strings': (('C String', 'C3'), ('G String', 'G3'), ('D String', 'D4'), ('A String', 'A4')),
+              'positions': 7, 'spacing': (0, 2, 3, 5), 'highest': None},
+    'cello': {'strings': (('C String', 'C2'), ('G String', 'G2'), ('D String', 'D3'), ('A String', 'A3')),
+              'positions': 7, 'spacing': (0, 1, 2, 3), 'highest': None},
+}
+
+# A position puts the 1st finger one step of the major scale of the string higher than the previous one
+MAJOR_SCALE = (0, 2, 4, 5, 7, 9, 11)
+# Finger lowered or raised by a semitone
+LOWERED, RAISED = '₁', '¹'
+
+# Semitones between the open string and the 1st finger of a position
+def position_offset(position):
+    octave, degree = divmod(position, len(MAJOR_SCALE))
+    return 12 * octave + MAJOR_SCALE[degree]
+
+# Fingers of a position: semitones above the open string -> finger ('0', '1₁', '2', '3¹'...).
+# A note between two fingers is played by the lower one raised, a note under the 1st finger by
+# the 1st finger lowered, and the 4th finger can be raised above its note.
+def position_fingers(position, spacing):
+    base = position_offset(position)
+    fingers = {base + step: str(finger) for finger, step in enumerate(spacing, start=1)}
+    if position == 1:
+        fingers[0] = '0'
+    fingers.setdefault(base - 1, f"1{LOWERED}")
+    for finger, step in enumerate(spacing, start=1):
+        fingers.setdefault(base + step + 1, f"{finger}{RAISED}")
+    return dict(sorted(fingers.items()))
+
+# Order in which the positions of the highest string are tried: odd positions first
+def position_priority(positions):
+    return sorted(range(1, positions + 1), key=lambda position: (position % 2 == 0, position))
+
+def is_extension(finger):
+    return finger != finger.strip(LOWERED + RAISED)
+
+# Compile the tables of a tuning (memoized, switching instruments only looks them up):
+# 'candidate_table': MIDI number -> every (finger, string, position) of the fingerboard, on every
+#   string up to the last position, best first (candidate_rank)
+# 'fingering_table': MIDI number -> the best candidate (the greedy choice), or None
+@lru_cache(maxsize=None)
+def compile_tuning(strings, positions, spacing, highest=None):
+    names = [name for name, note in strings]
+    open_midi = {name: note_name_to_midi(note) for name, note in strings}
+    priority = position_priority(positions)
+
+    # Ranking policy, best first:
+    # 1. 1st position on the lower strings: lowest finger, then lowest string. An extended finger
+    #    doesn't reach the notes of the next string, they are played there.
+    # 2. The highest string, in any position: lowest finger, then the first one of position_priority.
+    # 3. The other positions of the lower strings: lowest position, then no extension, then lowest finger.
+    def candidate_rank(midi, fingering):
+        finger, string, position = fingering
+        string_index = names.index(string)
+        if string_index == len(names) - 1:
+            return 1, finger_number(finger), priority.index(position)
+        next_open = open_midi[names[string_index + 1]]
+        if position == 1 and not (is_extension(finger) and midi >= next_open):
+            return 0, finger_number(finger), string_index
+        return 2, position, is_extension(finger), finger_number(finger), string_index
+
+    candidate_table = [[] for _ in range(128)]
+    for string in names:
+        for position in range(1, positions + 1):
+            for offset, finger in position_fingers(position, spacing).items():
+                midi = open_midi[string] + offset
+                if midi <= 127:
+                    candidate_table[midi].append((finger, string, position))
+    candidate_table = [tuple(sorted(candidates, key=lambda fingering: candidate_rank(midi, fingering)))
+                       for midi, candidates in enumerate(candidate_table)]
+    fingering_table = [candidates[0] if candidates else None for candidates in candidate_table]
+
+    playable = [midi for midi, fingering in enumerate(fingering_table) if fingering]
+    lowest_midi = open_midi[names[0]]
+    highest_midi = min(note_name_to_midi(highest), playable[-1]) if highest else playable[-1]
+    version = hashlib.sha1(repr((strings, positions, spacing, lowest_midi, highest_midi,
+                                 fingering_table, candidate_table)).encode('utf-8')).hexdigest()
+    return {'strings': names, 'open_midi': open_midi, 'lowest': lowest_midi, 'highest': highest_midi,
+            'fingering_table': fingering_table, 'candidate_table': candidate_table, 'version': version,
+            # NumPy arrays of the tables, built on first use
+            'arrays': {}}
+
+# Function to get the compiled tables of an instrument, with the open notes of a scordatura if given
+# ("G3 D4 A4 D5", from the lowest string). Each tuning is compiled once.
+compiled_instruments = {}
+
+def instrument_tables(name, tuning=None):
+    notes = tuple(tuning.split() if isinstance(tuning, str) else tuning) if tuning else None
+    if (name, notes) not in compiled_instruments:
+        compiled_instruments[name, notes] = compile_instrument(name, notes)
+    return compiled_instruments[name, notes]
+
+def compile_instrument(name, tuning):
+    if name not in INSTRUMENTS:
+        raise ValueError(f"Unknown instrument {name} (instruments: {', '.join(INSTRUMENTS)})")
+    description = INSTRUMENTS[name]
+    strings = description['strings']
+    if tuning:
+        if len(tuning) != len(strings) or any(note_name_to_midi(note) is None for note in tuning):
+            raise ValueError(f"The tuning of the {name} is {len(strings)} notes like "
+                             f"{' '.join(note for _, note in strings)}, not {' '.join(tuning)}")
+        strings = tuple((string, note) for (string, _), note in zip(strings, tuning))
+    return compile_tuning(strings, description['positions'], description['spacing'], description['highest'])
+
+# Instrument used for the next conversions, and its tables
+instrument = None
+instrument_tuning = None
+
+def set_instrument(name, tuning=None):
+    global instrument, instrument_tuning, instrument_strings, open_string_midi, lowest_midi, highest_midi
+    global fingering_table, candidate_table, fingering_tables_version, compiled_tables
+    compiled_tables = instrument_tables(name, tuning)
+    instrument, instrument_tuning = name, tuning or None
+    instrument_strings = compiled_tables['strings']
+    open_string_midi = compiled_tables['open_midi']
+    lowest_midi, highest_midi = compiled_tables['lowest'], compiled_tables['highest']
+    fingering_table = compiled_tables['fingering_table']
+    candidate_table = compiled_tables['candidate_table']
+    fingering_tables_version = compiled_tables['version']
+
+# The instrument and tuning, for the worker processes that don't share this one's settings
+def current_instrument():
+    return instrument, instrument_tuning
+
+# Tables of an instrument given as (name, tuning), the current one's without: the conversions
+# of a worker thread keep their instrument when set_instrument is called meanwhile
+def tables_of(instrument=None):
+    return compiled_tables if instrument is None else instrument_tables(*instrument)
+
+set_instrument('violin')
+
+# Fingering choice: 'greedy' takes the table entry of each note on its own,
+# 'optimized' chooses among every candidate of the phrase with the lowest total cost
+FINGERING_MODES = ('greedy', 'optimized')
+fingering_mode = 'greedy'
+
+# Change the fingering choice used for the next conversions
+def set_fingering_mode(mode):
+    global fingering_mode
+    fingering_mode = mode
+
+# Costs of the optimizer: moving the hand, crossing strings, extended fingers and high positions
+FINGERING_COSTS = {
+    'shift': 2.0,      # per position moved between two notes
+    'crossing': 1.0,   # per string crossed between two notes
+    'extension': 0.5,  # lowered or raised finger (1₁, 1¹...)
+    'position': 0.3,   # per position above the 1st
+}
+# Measures per phrase solved by the optimizer, 0 for the whole part at once
+OPTIMIZER_PHRASE_MEASURES = 0
+
+# Settings the fingering of a score depends on, kept with its conversion:
+# ((instrument, tuning), fingering mode, phrase measures)
+def conversion_settings():
+    return current_instrument(), fingering_mode, OPTIMIZER_PHRASE_MEASURES
+
+# Candidates as padded arrays (128 x most candidates): position (NaN for open strings),
+# string number and the cost of the note itself (inf for the padding), per instrument
+def get_candidate_arrays(tables=None):
+    tables = tables or compiled_tables
+    arrays = tables['arrays']
+    if 'candidates' not in arrays:
+        import numpy as np
+        candidate_table = tables['candidate_table']
+        width = max(len(candidates) for candidates in candidate_table)
+        positions = np.full((128, width), np.nan)
+        strings = np.zeros((128, width))
+        extensions = np.zeros((128, width))
+        valid = np.zeros((128, width), dtype=bool)
+        for midi, candidates in enumerate(candidate_table):
+            for k, (finger, string, position) in enumerate(candidates):
+                if finger != '0':
+                    positions[midi, k] = position
+                strings[midi, k] = tables['strings'].index(string)
+                extensions[midi, k] = is_extension(finger)
+                valid[midi, k] = True
+        arrays['candidates'] = (positions, strings, extensions, valid)
+    return arrays['candidates']
+
+# Notes whose transition costs are computed at once, so the memory doesn't grow with the phrase
+OPTIMIZER_CHUNK_NOTES = 2048
+
+# Viterbi over the candidates of a sequence of MIDI numbers: index of the chosen candidate of each note
+def optimize_candidates(midis, costs=None, tables=None):
+    import numpy as np
+    costs = costs or FINGERING_COSTS
+    positions, strings, extensions, valid = get_candidate_arrays(tables)
+    midis = np.asarray(midis, dtype=np.intp)
+    position, string = positions[midis], strings[midis]
+
+    # Cost of each note on its own
+    node_costs = costs['extension'] * extensions[midis] + costs['position'] * np.nan_to_num(position - 1)
+    node_costs[~valid[midis]] = np.inf
+
+    best = node_costs[0]
+    backpointers = np.empty((len(midis) - 1, best.shape[0]), dtype=np.uint8)
+    columns = np.arange(best.shape[0])
+    for start in range(0, len(midis) - 1, OPTIMIZER_CHUNK_NOTES):
+        # Cost of every (previous candidate, next candidate) pair for the notes of the chunk.
+        # An open string leaves the hand where it is, so it never costs a shift.
+        chunk = slice(start, start + OPTIMIZER_CHUNK_NOTES + 1)
+        shifts = np.nan_to_num(np.abs(position[chunk][:-1, :, None] - position[chunk][1:, None, :]))
+        crossings = np.abs(string[chunk][:-1, :, None] - string[chunk][1:, None, :])
+        transitions = costs['shift'] * shifts + costs['crossing'] * crossings
+        for i, transition in enumerate(transitions, start=start):
+            totals = best[:, None] + transition
+            backpointers[i] = totals.argmin(axis=0)
+            best = totals[backpointers[i], columns] + node_costs[i + 1]
+
+    path = np.empty(len(midis), dtype=np.intp)
+    path[-1] = best.argmin()
+    for i in range(len(midis) - 2, -1, -1):
+        path[i] = backpointers[i, path[i + 1]]
+    return path
+
+# Fingerings of a note on the whole fingerboard, best first: the choices offered instead of the greedy one
+def fingering_alternatives(midi):
+    return candidate_table[midi] if 0 <= midi < len(candidate_table) else ()
+
+# Optimized fingering of a phrase of MIDI numbers (negative when unreadable):
+# (finger, string, position) per note, None for the notes without candidate
+def optimize_fingering(midis, costs=None, tables=None):
+    tables = tables or compiled_tables
+    candidate_table = tables['candidate_table']
+    playable = [i for i, midi in enumerate(midis)
+                if tables['lowest'] <= midi <= tables['highest'] and candidate_table[midi]]
+    fingerings = [None] * len(midis)
+    if playable:
+        path = optimize_candidates([midis[i] for i in playable], costs, tables)
+        for i, k in zip(playable, path):
+            fingerings[i] = candidate_table[midis[i]][k]
+    return fingerings
+
+# On-disk cache of converted scores, keyed by the file content and the fingering tables.
+# Entries are zlib-compressed JSON; the least recently used ones go above CACHE_MAX_BYTES.
+CACHE_FORMAT_VERSION = 2
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+cache_directory = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.expanduser('~/.cache'),
+                               'MuseScoreToViolinConverter')
+
+# Function to compute the cache key of a score, for the current settings or the given ones
+def score_cache_key(file_path, engine=None, mode=None, parts=None, phrase_measures=None, instrument=None):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    # Any change in the cache format, the instrument or its tables gives new cache keys
+    digest.update(f"{CACHE_FORMAT_VERSION}:{tables_of(instrument)['version']}".encode('utf-8'))
+    # MusicXML files may be read by different engines
+    if not file_path.endswith(('.mscx', '.mscz')):
+        digest.update((engine or musicxml_engine).encode('utf-8'))
+    # The optimized fingering depends on the costs and the phrase length
+    if (mode or fingering_mode) != 'greedy':
+        phrase_measures = OPTIMIZER_PHRASE_MEASURES if phrase_measures is None else phrase_measures
+        digest.update(repr((sorted(FINGERING_COSTS.items()), phrase_measures)).encode('utf-8'))
+    # Only some parts of the score
+    if parts is not None:
+        digest.update(repr(part_keys(parts)).encode('utf-8'))
+    return digest.hexdigest()
+
+def cache_entry_path(cache_key):
+    return os.path.join(cache_directory, f"{cache_key}.json.z")
+
+# Function to get the (NoteEvents, fingerings) of a cached score, None if not cached
+def load_cached_score(cache_key):
+    path = cache_entry_path(cache_key)
+    try:
+        with open(path, 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+        # Mark the entry as recently used
+        os.utime(path)
+    except (OSError, ValueError, zlib.error):
+        return None
+    fingerings = [[tuple(fingering) for fingering in measure] for measure in data['fingerings']]
+    return NoteEvents.from_record(data['measures']), fingerings
+
+# Function to store a converted score in the cache
+def store_cached_score(cache_key, measures, fingerings):
+    path = cache_entry_path(cache_key)
+    data = zlib.compress(json.dumps({'measures': measures.to_record(), 'fingerings': fingerings},
+                                    ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        write_atomically(path, data)
+        evict_cache()
+    except OSError as e:
+        print(f"Error writing the cache: {e}")
+
+# Remove the least recently used entries until the cache fits in CACHE_MAX_BYTES
+def evict_cache():
+    entries = []
+    for name in os.listdir(cache_directory):
+        if name.endswith('.json.z'):
+            path = os.path.join(cache_directory, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total_size -= size
+
+# Shared style tags: one per E string position, out-of-range style and text colour.
+# They are configured once per Text widget and reused by the conversion, the colour
+# buttons and the HTML export, so the number of tags doesn't grow with the score.
+def build_style_palette():
+    palette = {}
+    for position, color_info in position_colors.items():
+        palette[f"position_{position}"] = dict(color_info)
+    palette['low'] = {'foreground': 'green', 'background': 'black'}
+    palette['high'] = {'foreground': 'turquoise', 'background': 'black'}
+    palette['unknown'] = {'foreground': 'white', 'background': 'red'}
+    # Text colours last: Tk gives priority to the last created tag, so a recoloured note shows its new colour
+    for color in string_colors.values():
+        palette[f"fg_{color}"] = {'foreground': color}
+    return palette
+
+style_palette = build_style_palette()
+
+# Function to read back a CSS rule written by style_to_css
+def css_to_style(css):
+    style = {}
+    for declaration in css.split(';'):
+        name, _, value = declaration.partition(':')
+        name, value = name.strip(), value.strip()
+        if value and name == 'color':
+            style['foreground'] = value
+        elif value and name == 'background-color':
+            style['background'] = value
+    return style
+
+# Function to get the (text, tags) runs of a converted measure line
+def fingering_runs(i, fingering):
+    runs = [(f"M{i+1:03d}: ", ())]
+    for text, tag in fingering:
+        runs.append((text, (tag,)))
+        runs.append((" ", ()))
+    return runs
+
+# Function to turn (text, tags) runs into a line record: (text, [(start, end, tag), ...]).
+# Contiguous runs sharing a tag give a single range.
+def runs_to_record(runs):
+    ranges = []
+    open_ranges = {}
+    position = 0
+    for text, tags in runs:
+        for tag in list(open_ranges):
+            if tag not in tags:
+                ranges.append((open_ranges.pop(tag), position, tag))
+        for tag in tags:
+            open_ranges.setdefault(tag, position)
+        position += len(text)
+    for tag, start in open_ranges.items():
+        ranges.append((start, position, tag))
+    ranges.sort()
+    return ''.join(text for text, tags in runs), ranges
+
+# Function to give a line record the "M001: " label of measure i, its tag ranges move with the text
+MEASURE_LABEL_PATTERN = re.compile(r'M\d+: ')
+
+def relabel_record(record, i):
+    text, ranges = record
+    match = MEASURE_LABEL_PATTERN.match(text)
+    label = f"M{i+1:03d}: "
+    if not match or match.group() == label:
+        return record
+    shift = len(label) - match.end()
+    return label + text[match.end():], [(start + shift if start >= match.end() else start, end + shift, tag)
+                                        for start, end, tag in ranges]
+
+# Function to turn a line record back into (text, tags) runs
+def record_to_runs(record):
+    text, ranges = record
+    boundaries = sorted({0, len(text)} | {start for start, end, tag in ranges} | {end for start, end, tag in ranges})
+    runs = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        tags = tuple(tag for tag_start, tag_end, tag in ranges if tag_start <= start and end <= tag_end)
+        if runs and runs[-1][1] == tags:
+            runs[-1] = (runs[-1][0] + text[start:end], tags)
+        else:
+            runs.append((text[start:end], tags))
+    return runs
+
+# Function to convert one note to its fingering: returns (text, palette tag)
+def convert_note(note_name, tables=None):
+    tables = tables or compiled_tables
+    # Check if the note is outside the range of the instrument
+    midi = note_name_to_midi(note_name)
+    if midi is not None and midi < tables['lowest']:
+        # Notes lower than the lowest open string (G3 on the violin)
+        return note_name, 'low'
+    elif midi is not None and midi > tables['highest']:
+        # Notes higher than the instrument (E6 on the violin)
+        return note_name, 'high'
+
+    fingering = tables['fingering_table'][midi] if midi is not None else None
+    if fingering:
+        return styled_fingering(fingering, tables)
+
+    # If the note does not match any category
+    return "?", 'unknown'
+
+# Roman numerals of the positions, written after the finger on the lower strings above the 1st position
+POSITION_NUMERALS = ('', 'I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X')
+
+# (finger, string, position) -> (text, palette tag)
+def styled_fingering(fingering, tables=None):
+    finger, string, position = fingering
+    # The highest string (E on the violin) is colored by position, the others by string
+    if string == (tables or compiled_tables)['strings'][-1]:
+        return finger, f"position_{position}"
+    # Their colour doesn't show the position: "1/III" is the 1st finger in 3rd position
+    if position > 1:
+        finger = f"{finger}/{POSITION_NUMERALS[position]}"
+    return finger, f"fg_{string_colors.get(string, 'black')}"
+
+# Greedy table as arrays indexed by MIDI number: string number (-1 without fingering),
+# finger text, position and palette tag. Built on the first conversion with each instrument.
+def get_fingering_arrays(tables=None):
+    tables = tables or compiled_tables
+    arrays = tables['arrays']
+    if 'fingering' not in arrays:
+        arrays['fingering'] = build_fingering_arrays(tables)
+    return arrays['fingering']
+
+def build_fingering_arrays(tables):
+    import numpy as np
+    strings = np.full(128, -1, dtype=np.int8)
+    fingers = np.full(128, '?', dtype=object)
+    positions = np.zeros(128, dtype=np.int8)
+    tags = np.full(128, 'unknown', dtype=object)
+    for midi, fingering in enumerate(tables['fingering_table']):
+        if fingering:
+            finger, string, position = fingering
+            strings[midi] = tables['strings'].index(string)
+            fingers[midi], tags[midi] = styled_fingering(fingering, tables)
+            positions[midi] = position
+    return strings, fingers, positions, tags
+
+# Function to get the arrays of NoteEvents as NumPy arrays (no copy): MIDI number, measure index and note index
+def score_arrays(events):
+    import numpy as np
+    midi = np.frombuffer(events.pitch, dtype=np.int16).astype(np.int32)
+    starts = np.frombuffer(events.measure_starts, dtype=np.int32)
+    measure = np.frombuffer(events.measure, dtype=np.int32)
+    return {
+        'events': events,
+        'counts': np.diff(np.append(starts, len(events))),
+        'midi': midi,
+        'readable': midi >= 0,
+        'measure': measure,
+        'note': np.arange(len(events)) - starts[measure],
+    }
+
+# Greedy fingering of every note of score_arrays at once, with array lookups and masks
+def convert_score_arrays(score, tables=None):
+    import numpy as np
+    tables = tables or compiled_tables
+    fingering_strings, fingering_fingers, fingering_positions, fingering_tags = get_fingering_arrays(tables)
+    midi, readable = score['midi'], score['readable']
+    low = readable & (midi < tables['lowest'])
+    high = readable & (midi > tables['highest'])
+    in_range = readable & ~low & ~high
+    lookup = np.where(in_range, midi, 0)
+    string = np.where(in_range, fingering_strings[lookup], -1)
+    tag = np.where(in_range, fingering_tags[lookup], 'unknown')
+    tag[low] = 'low'
+    tag[high] = 'high'
+    return {
+        'string': string,
+        'finger': np.where(in_range, fingering_fingers[lookup], '?'),
+        'position': np.where(in_range, fingering_positions[lookup], 0),
+        'low': low,
+        'high': high,
+        'unknown': string < 0,
+        'tag': tag,
+    }
+
+# Back to the (text, tag) lists per measure used by the Textboxes and the exports.
+# Notes out of the violin range keep their name.
+def fingerings_from_arrays(score, converted):
+    import numpy as np
+    events = score['events']
+    texts = converted['finger'].copy()
+    for i in np.flatnonzero(converted['low'] | converted['high']).tolist():
+        texts[i] = note_name(events.pitch[i], events.alter[i])
+    pairs = list(zip(texts.tolist(), converted['tag'].tolist()))
+    fingerings, start = [], 0
+    for count in score['counts'].tolist():
+        fingerings.append(pairs[start:start + count])
+        start += count
+    return fingerings
+
+# Function to convert NoteEvents to their (text, tag) fingering per measure,
+# with the current instrument or the given (name, tuning)
+def convert_measures(measures, mode=None, instrument=None):
+    tables = tables_of(instrument)
+    if (mode or fingering_mode) == 'greedy':
+        score = score_arrays(measures)
+        return fingerings_from_arrays(score, convert_score_arrays(score, tables))
+
+    # The optimizer follows each staff and voice through the measures on its own:
+    # no transition from the last note of one to the first note of the next
+    lines = {}
+    for i, line in enumerate(zip(measures.staff, measures.voice)):
+        lines.setdefault(line, []).append(i)
+    optimized = [None] * len(measures)
+    for indexes in lines.values():
+        for i, fingering in zip(indexes, optimize_fingering([measures.pitch[i] for i in indexes], tables=tables)):
+            optimized[i] = fingering
+    fingerings = []
+    for measure in range(measures.measure_count()):
+        start, end = measures.note_range(measure)
+        fingerings.append([styled_fingering(optimized[i], tables) if optimized[i]
+                           else convert_note(note_name(measures.pitch[i], measures.alter[i]), tables)
+                           for i in range(start, end)])
+    return fingerings
+
+# Group the measures read from a file (or already in NoteEvents) into the NoteEvents converted at once:
+# MEASURES_PER_BATCH measures for the greedy mode, OPTIMIZER_PHRASE_MEASURES (or everything) for the optimizer
+def measure_batches(measures, mode=None, phrase_measures=None):
+    if (mode or fingering_mode) == 'greedy':
+        size = MEASURES_PER_BATCH
+    else:
+        size = OPTIMIZER_PHRASE_MEASURES if phrase_measures is None else phrase_measures
+    if isinstance(measures, NoteEvents):
+        count = measures.measure_count()
+        for first in range(0, count, size or max(count, 1)):
+            yield measures.measure_slice(first, first + (size or count))
+        return
+    batch = NoteEvents()
+    for notes in measures:
+        batch.add_measure(notes)
+        if size and batch.measure_count() >= size:
+            yield batch
+            batch = NoteEvents()
+    if batch.measure_count():
+        yield batch
+
+# Function to compare the measure hashes of two readings of a score: difflib opcodes
+# (tag, old first, old last, new first, new last), the 'equal' measures are unchanged
+def diff_measures(old_hashes, new_hashes):
+    return difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False).get_opcodes()
+
+# Function to get the fingerings of a new reading of a score from the ones of the old reading:
+# unchanged measures keep their fingering, only the others are converted (for the optimizer,
+# the whole phrases holding a changed measure). Everything is converted when the old reading was
+# converted with other settings (see conversion_settings). Returns the fingerings and the measures converted.
+def reconvert_measures(events, old_fingerings, opcodes, old_settings, settings):
+    instrument, mode, phrase_measures = settings
+    fingerings = [None] * events.measure_count()
+    old_measures = [None] * events.measure_count()
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            fingerings[j1:j2] = old_fingerings[i1:i2]
+            old_measures[j1:j2] = range(i1, i2)
+    if settings != old_settings:
+        ranges = [(0, len(fingerings))] if fingerings else []
+    elif mode == 'greedy':
+        ranges = [(j1, j2) for tag, i1, i2, j1, j2 in opcodes if tag != 'equal' and j2 > j1]
+    else:
+        # A phrase is kept only if it was a whole phrase of the old reading: measures inserted
+        # or removed before it move the phrase boundaries
+        old_count = len(old_fingerings)
+        size = phrase_measures or max(len(fingerings), 1)
+        old_size = phrase_measures or max(old_count, 1)
+        ranges = []
+        for first in range(0, len(fingerings), size):
+            last = min(first + size, len(fingerings))
+            old_first = old_measures[first]
+            if (old_first is None or old_first % old_size or min(old_first + old_size, old_count) - old_first != last - first
+                    or old_measures[first:last] != list(range(old_first, old_first + last - first))):
+                ranges.append((first, last))
+    converted = 0
+    for first, last in ranges:
+        batch_fingerings = []
+        for batch in measure_batches(events.measure_slice(first, last), mode, phrase_measures):
+            batch_fingerings.extend(convert_measures(batch, mode, instrument))
+        fingerings[first:last] = batch_fingerings
+        converted += last - first
+    return fingerings, converted
+
+# Function to read a score again after it was saved and convert only its changed measures,
+# in a worker thread: (NoteEvents, fingerings, opcodes, measures converted).
+# old_settings are the conversion settings of the old reading, settings the ones of the new reading:
+# the worker thread doesn't read the settings that the window may change meanwhile.
+# The new reading goes to the cache like a loaded score.
+def reread_score(file_path, old_events, old_fingerings, old_settings, settings, parts=None):
+    events = NoteEvents.from_measures(iter_measures(file_path, parts=parts))
+    opcodes = diff_measures(old_events.measure_hashes(), events.measure_hashes())
+    fingerings, converted = reconvert_measures(events, old_fingerings, opcodes, old_settings, settings)
+    if events.measure_count():
+        instrument, mode, phrase_measures = settings
+        cache_key = score_cache_key(file_path, mode=mode, parts=parts, phrase_measures=phrase_measures,
+                                    instrument=instrument)
+        store_cached_score(cache_key, events, fingerings)
+    return events, fingerings, opcodes, converted
+
+# Path of the HTML file holding the user's fingering next to the score
+def get_html_path(file_path, parts=None):
+    directory = os.path.dirname(file_path)
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(directory, f"{base_name}{parts_suffix(parts)}_fingering.html")
+
+# Convert a Tk tag configuration (foreground/background) to CSS
+def style_to_css(style):
+    css = ""
+    if style.get('foreground'):
+        css += f"color: {style['foreground']};"
+    if style.get('background'):
+        css += f" background-color: {style['background']};"
+    return css
+
+# Build the HTML document from {tag: css} styles and lines of (text, tags) runs
+def build_html(tag_styles, lines):
+    return html_document(tag_styles, [html_line_fragment(runs) for runs in lines])
+
+# Function to get the HTML of one line of (text, tags) runs
+def html_line_fragment(runs):
+    # Démarrer une nouvelle ligne avec un div pour chaque mesure
+    html_content = ['<div class="measure">']
+    for text, tags in runs:
+        # Utiliser un tag 'default' pour le texte non stylé
+        tag_classes = ' '.join(tags) if tags else 'default'
+        html_content.append(f'<span class="{tag_classes}">{html.escape(text, quote=False)}</span>')
+    # Fermer le div de la mesure avec un saut de ligne visuel
+    html_content.append('</div>')
+    return ''.join(html_content)
+
+# Build the HTML document from {tag: css} styles and the HTML fragment of each line
+def html_document(tag_styles, fragments):
+    # Préparer le contenu HTML avec les styles
+    html_content = ['<!DOCTYPE html>', '<html>', '<head>', '<style>']
+    html_content.append('''
+        body { white-space: pre-wrap; font-family: monospace; }
+        .default { color: black; }  /* Style par défaut */
+    ''')
+
+    # Ajouter les styles des tags dans le HTML, dans l'ordre de la palette : comme dans Tk, où le tag
+    # créé le plus tard l'emporte, une couleur choisie par l'utilisateur passe devant la couleur de position
+    palette_order = {tag: i for i, tag in enumerate(style_palette)}
+    for tag, style in sorted(tag_styles.items(), key=lambda item: palette_order.get(item[0], len(palette_order))):
+        html_content.append(f'.{tag} {{ {style} }}')
+    html_content.extend(['</style>', '</head>', '<body>'])
+    html_content.extend(fragments)
+    html_content.extend(['</body>', '</html>'])
+    return ''.join(html_content)
+
+# Function to write a file through a temporary file, so it is never left half written
+def write_atomically(path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+# Extensions handled by the converter
+SCORE_EXTENSIONS = ('.musicxml', '.mxl', '.mscx', '.mscz')
+
+# Function to read and convert a score without any window: its NoteEvents, the fingerings
+# per measure, the parts read (None for the whole score) and the timings
+def convert_score(file_path, engine=None, mode=None, phrase_measures=None, part_selection=None, instrument=None):
+    if instrument is not None:
+        set_instrument(*instrument)
+    start = time.perf_counter()
+    parts = select_parts(list_parts(file_path), part_selection) if part_selection not in (None, 'all') else None
+
+    # Measures are converted as soon as the reader yields them (a whole phrase for the optimizer)
+    events, fingerings = NoteEvents(), []
+    convert_time = 0
+    for batch in measure_batches(iter_measures(file_path, engine, parts), mode, phrase_measures):
+        events.extend(batch)
+        step = time.perf_counter()
+        fingerings.extend(convert_measures(batch, mode))
+        convert_time += time.perf_counter() - step
+    if not fingerings:
+        raise Exception("No measures found in the file")
+    timings = {'convert': convert_time, 'parse': time.perf_counter() - start - convert_time}
+    return {'events': events, 'fingerings': fingerings, 'parts': parts, 'timings': timings}
+
+# Function to build the fingering HTML of converted measures, like the export of the window
+def fingering_html(fingerings):
+    tag_styles = {tag: style_to_css(style_palette[tag]) for fingering in fingerings for text, tag in fingering}
+    return build_html(tag_styles, [fingering_runs(i, fingering) for i, fingering in enumerate(fingerings)])
+
+# Function to get the HTML file of a score converted without any window: next to it, or in output_dir
+def output_html_path(file_path, output_dir=None, parts=None):
+    html_path = get_html_path(file_path, parts)
+    if output_dir:
+        html_path = os.path.join(output_dir, os.path.basename(html_path))
+    return html_path
+
+# Function to convert a score to its fingering HTML without any window (to html_path if given)
+def convert_file(file_path, output_dir=None, engine=None, mode=None, phrase_measures=None, part_selection=None,
+                 instrument=None, html_path=None):
+    start = time.perf_counter()
+    score = convert_score(file_path, engine, mode, phrase_measures, part_selection, instrument)
+    fingerings, parts, timings = score['fingerings'], score['parts'], score['timings']
+
+    step = time.perf_counter()
+    html_path = html_path or output_html_path(file_path, output_dir, parts)
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(fingering_html(fingerings))
+    timings['export'] = time.perf_counter() - step
+    timings['total'] = time.perf_counter() - start
+
+    return {'file': file_path, 'output': html_path, 'measures': len(fingerings),
+            'notes': sum(len(fingering) for fingering in fingerings),
+            'parts': [part['name'] for part in parts] if parts is not None else None, 'timings': timings}
+
+# Function to list the scores of the given files and directories
+def find_scores(paths):
+    scores = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, file_names in os.walk(path):
+                scores.extend(os.path.join(directory, name) for name in sorted(file_names)
+                              if name.lower().endswith(SCORE_EXTENSIONS))
+        else:
+            scores.append(path)
+    return scores
+
+# Function to choose the HTML file of each score of a batch: {score: path}, and the failures.
+# Scores of the same name (a.mscx, a.mscz, a.musicxml) get their extension in the file name
+# instead of overwriting each other.
+def batch_output_paths(scores, output_dir=None, part_selection=None):
+    html_paths, failures = {}, []
+    for path in scores:
+        try:
+            parts = select_parts(list_parts(path), part_selection) if part_selection not in (None, 'all') else None
+            html_paths[path] = output_html_path(path, output_dir, parts)
+        except Exception as e:
+            failures.append({'file': path, 'error': str(e)})
+
+    def same_outputs():
+        outputs = {}
+        for path, html_path in html_paths.items():
+            outputs.setdefault(os.path.normcase(os.path.abspath(html_path)), []).append(path)
+        return [paths for paths in outputs.values() if len(paths) > 1]
+
+    for paths in same_outputs():
+        for path in paths:
+            base_name, extension = os.path.splitext(os.path.basename(path))
+            html_name = os.path.basename(html_paths[path])
+            html_paths[path] = os.path.join(os.path.dirname(html_paths[path]),
+                                            f"{base_name}_{extension.lstrip('.')}{html_name[len(base_name):]}")
+    # Still the same file (a.mscz next to a_mscz.mscz...): these scores are not converted
+    for paths in same_outputs():
+        for path in paths:
+            failures.append({'file': path, 'error': f"Same output file as {', '.join(p for p in paths if p != path)}: "
+                                                   f"{html_paths.pop(path)}"})
+    return html_paths, failures
+
+# Headless mode: convert every score with a process pool and report a summary.
+# Existing HTML files (which may hold the fingering edited in the window) are kept unless args.force.
+def run_batch(args):
+    scores = find_scores(args.paths)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    html_paths, failures = batch_output_paths(scores, args.output_dir, args.parts)
+    for failure in failures:
+        print(f"FAIL  {failure['file']}: {failure['error']}")
+    skipped = []
+    if not args.force:
+        for path, html_path in list(html_paths.items()):
+            if os.path.exists(html_path):
+                skipped.append({'file': path, 'output': html_path})
+                del html_paths[path]
+                print(f"SKIP  {path}: {html_path} exists (--force to overwrite)")
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(convert_file, path, args.output_dir, args.engine, args.fingering,
+                                   args.phrase_measures, args.parts, (args.instrument, args.tuning), html_path): path
+                   for path, html_path in html_paths.items()}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                print(f"OK    {result['timings']['total']:8.3f}s  {path}")
+            except Exception as e:
+                failures.append({'file': path, 'error': str(e)})
+                print(f"FAIL  {path}: {e}")
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        'files': len(scores),
+        'converted': len(results),
+        'skipped': len(skipped),
+        'failed': len(failures),
+        'elapsed': elapsed,
+        'results': sorted(results, key=lambda r: r['file']),
+        'skipped_files': sorted(skipped, key=lambda s: s['file']),
+        'failures': sorted(failures, key=lambda f: f['file']),
+    }
+    print(f"{len(results)}/{len(scores)} files converted in {elapsed:.2f}s "
+          f"({len(skipped)} skipped, {len(failures)} failed)")
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if failures else 0
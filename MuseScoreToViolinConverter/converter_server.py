@@ -0,0 +1,359 @@
+# Local conversion service: scores uploaded over HTTP are converted by a pool of worker
+# processes and answered with their fingering HTML or JSON, without Tk.
+#
+#   python converter_server.py --port 8765 --jobs 4
+#
+#   GET  /          upload page
+#   POST /convert   the score file as request body, options in the query string:
+#                   filename (required, for its extension), format=html|json, instrument, tuning,
+#                   fingering, phrase_measures, engine, parts
+#   GET  /metrics   queue depth, latencies and cache statistics (JSON)
+#
+# The server only listens on the loopback interface and never needs the network. Results are
+# kept in memory by the hash of the upload and its options: a repeated upload is answered
+# without being converted again, and the same upload sent twice at once is converted once.
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import converter_core as core
+
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# Uploads waiting for a worker beyond those being converted, the next ones are refused (503)
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_CACHE_BYTES = 100 * 1024 * 1024
+# Requests and conversions kept for the latency metrics
+LATENCY_SAMPLES = 1000
+
+OUTPUT_FORMATS = {'html': 'text/html; charset=utf-8', 'json': 'application/json; charset=utf-8'}
+
+class QueueFull(Exception):
+    pass
+
+# Function to read the conversion options of a request, ValueError if one is wrong
+def request_options(query):
+    def value(name, default=None):
+        return query.get(name, [''])[0] or default
+
+    options = {
+        'engine': value('engine', 'auto'),
+        'fingering': value('fingering', 'greedy'),
+        'phrase_measures': int(value('phrase_measures', '0')),
+        'instrument': value('instrument', 'violin'),
+        'tuning': value('tuning'),
+        'parts': value('parts', 'all'),
+    }
+    if options['engine'] not in core.MUSICXML_ENGINES:
+        raise ValueError(f"Unknown engine {options['engine']} (engines: {', '.join(core.MUSICXML_ENGINES)})")
+    if options['fingering'] not in core.FINGERING_MODES:
+        raise ValueError(f"Unknown fingering {options['fingering']} (fingerings: {', '.join(core.FINGERING_MODES)})")
+    if options['phrase_measures'] < 0:
+        raise ValueError("phrase_measures can't be negative")
+    # Unknown instrument or wrong tuning
+    core.instrument_tables(options['instrument'], options['tuning'])
+    return options
+
+# Function to compute the key of an upload in the result cache: its content, its extension
+# (which reader reads it) and everything the fingering depends on
+def result_key(data, extension, options):
+    digest = hashlib.sha256(data)
+    tables_version = core.instrument_tables(options['instrument'], options['tuning'])['version']
+    digest.update(repr((extension, sorted(options.items()), core.CACHE_FORMAT_VERSION, tables_version,
+                        sorted(core.FINGERING_COSTS.items()))).encode('utf-8'))
+    return digest.hexdigest()
+
+# Function run by a worker process: convert an upload, return its answers in both formats
+def convert_upload(data, file_name, options):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'score' + os.path.splitext(file_name)[1].lower())
+        with open(path, 'wb') as f:
+            f.write(data)
+        score = core.convert_score(path, options['engine'], options['fingering'], options['phrase_measures'],
+                                   options['parts'], (options['instrument'], options['tuning']))
+    events, fingerings, parts = score['events'], score['fingerings'], score['parts']
+    document = {
+        'file': file_name,
+        'instrument': options['instrument'],
+        'tuning': options['tuning'],
+        'fingering': options['fingering'],
+        'parts': [part['name'] for part in parts] if parts is not None else None,
+        'styles': {tag: core.style_to_css(core.style_palette[tag])
+                   for fingering in fingerings for text, tag in fingering},
+        'measures': [{'number': i + 1,
+                      'notes': events.measure_note_names(i) if i < events.measure_count() else [],
+                      'fingerings': [[text, tag] for text, tag in fingering]}
+                     for i, fingering in enumerate(fingerings)],
+        'timings': score['timings'],
+    }
+    return {'html': core.fingering_html(fingerings).encode('utf-8'),
+            'json': json.dumps(document, ensure_ascii=False).encode('utf-8')}
+
+# Count, mean, median, 95th percentile and maximum of durations in seconds
+def latency_summary(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+    return {'count': len(samples),
+            'mean': round(sum(samples) / len(samples), 6),
+            'p50': round(samples[len(samples) // 2], 6),
+            'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 6),
+            'max': round(samples[-1], 6)}
+
+# The worker pool, the result cache and the metrics shared by the request threads
+class ConversionService:
+    def __init__(self, jobs=None, max_queue=DEFAULT_MAX_QUEUE, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.jobs = jobs or os.cpu_count()
+        self.max_queue = max_queue
+        self.cache_bytes = cache_bytes
+        self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+        # The done callbacks may run in the thread holding the lock
+        self.lock = threading.RLock()
+        self.cache = OrderedDict()  # key -> answers, least recently used first
+        self.cached_bytes = 0
+        self.in_flight = {}         # key -> future of the uploads being converted or waiting
+        self.counters = {'requests': 0, 'conversions': 0, 'failures': 0, 'cache_hits': 0, 'coalesced': 0,
+                         'rejected': 0}
+        self.request_times = deque(maxlen=LATENCY_SAMPLES)
+        self.conversion_times = deque(maxlen=LATENCY_SAMPLES)
+        self.started = time.time()
+
+    # Function to get the answers of an upload: from the cache, from the conversion of the same
+    # upload already running, or from a new conversion. Returns (answers, 'hit' | 'coalesced' | 'miss').
+    def convert(self, data, file_name, options):
+        key = result_key(data, os.path.splitext(file_name)[1].lower(), options)
+        with self.lock:
+            answers = self.cache.get(key)
+            if answers is not None:
+                self.cache.move_to_end(key)
+                self.counters['cache_hits'] += 1
+                return answers, 'hit'
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.counters['coalesced'] += 1
+                status = 'coalesced'
+            else:
+                if len(self.in_flight) >= self.jobs + self.max_queue:
+                    self.counters['rejected'] += 1
+                    raise QueueFull()
+                future = self.submit(data, file_name, options)
+                self.in_flight[key] = future
+                start = time.perf_counter()
+                future.add_done_callback(lambda done: self.conversion_done(key, done, time.perf_counter() - start))
+                status = 'miss'
+        return future.result(), status
+
+    def submit(self, data, file_name, options):
+        try:
+            return self.executor.submit(convert_upload, data, file_name, options)
+        except BrokenProcessPool:
+            # A worker died (out of memory...): the next uploads get a new pool
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+            return self.executor.submit(convert_upload, data, file_name, options)
+
+    def conversion_done(self, key, future, seconds):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            self.conversion_times.append(seconds)
+            if future.cancelled() or future.exception() is not None:
+                self.counters['failures'] += 1
+                return
+            self.counters['conversions'] += 1
+            answers = future.result()
+            self.cache[key] = answers
+            self.cached_bytes += sum(len(answer) for answer in answers.values())
+            # Least recently used answers first
+            while self.cached_bytes > self.cache_bytes and self.cache:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= sum(len(answer) for answer in evicted.values())
+
+    def record_request(self, seconds):
+        with self.lock:
+            self.counters['requests'] += 1
+            self.request_times.append(seconds)
+
+    def metrics(self):
+        with self.lock:
+            in_flight = len(self.in_flight)
+            return {
+                'uptime': round(time.time() - self.started, 3),
+                'workers': self.jobs,
+                'in_flight': in_flight,
+                # Uploads waiting for a free worker
+                'queue_depth': max(0, in_flight - self.jobs),
+                'max_queue': self.max_queue,
+                **self.counters,
+                'cache_entries': len(self.cache),
+                'cache_bytes': self.cached_bytes,
+                'request_latency': latency_summary(self.request_times),
+                'conversion_latency': latency_summary(self.conversion_times),
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    server_version = "MuseScoreToViolinConverter"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/':
+            self.send_answer(200, upload_page().encode('utf-8'), 'text/html; charset=utf-8')
+        elif path == '/metrics':
+            self.send_json(200, self.server.service.metrics())
+        else:
+            self.send_json(404, {'error': f"No page {path}"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        if url.path != '/convert':
+            self.close_connection = True
+            self.send_json(404, {'error': f"No page {url.path}"})
+            return
+        try:
+            self.convert(parse_qs(url.query))
+        finally:
+            self.server.service.record_request(time.perf_counter() - start)
+
+    def convert(self, query):
+        length = int(self.headers.get('Content-Length') or 0)
+        file_name = query.get('filename', [''])[0]
+        output_format = query.get('format', ['html'])[0]
+        error = None
+        if not length:
+            status, error = 400, "Empty upload"
+        elif length > MAX_UPLOAD_BYTES:
+            status, error = 413, f"Uploads are limited to {MAX_UPLOAD_BYTES // 2**20} MB"
+        elif not file_name.lower().endswith(core.SCORE_EXTENSIONS):
+            status, error = 415, f"The filename must end with {', '.join(core.SCORE_EXTENSIONS)}"
+        elif output_format not in OUTPUT_FORMATS:
+            status, error = 400, f"Unknown format {output_format} (formats: {', '.join(OUTPUT_FORMATS)})"
+        if error:
+            # The upload is not read: the connection can't be reused
+            self.close_connection = True
+            self.send_json(status, {'error': error})
+            return
+        data = self.rfile.read(length)
+        try:
+            options = request_options(query)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            answers, cache_status = self.server.service.convert(data, file_name, options)
+        except QueueFull:
+            self.send_json(503, {'error': "Too many conversions waiting, try again later"}, {'Retry-After': '1'})
+            return
+        except Exception as e:
+            self.send_json(422, {'error': f"Error converting {file_name}: {e}"})
+            return
+        self.send_answer(200, answers[output_format], OUTPUT_FORMATS[output_format], {'X-Cache': cache_status})
+
+    def send_json(self, status, document, headers=None):
+        self.send_answer(status, json.dumps(document).encode('utf-8'), OUTPUT_FORMATS['json'], headers)
+
+    def send_answer(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+# The upload page: a form posting the file to /convert and showing the answer, without any
+# resource from the network
+def upload_page():
+    instruments = ''.join(f'<option>{name}</option>' for name in core.INSTRUMENTS)
+    fingerings = ''.join(f'<option>{mode}</option>' for mode in core.FINGERING_MODES)
+    return f'''<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Violin fingering</title>
+<style>body {{ font-family: sans-serif; }} iframe {{ width: 100%; height: 70vh; border: 1px solid gray; }}</style>
+</head>
+<body>
+<h1>Violin fingering</h1>
+<form id="form">
+<input type="file" id="file" accept="{','.join(core.SCORE_EXTENSIONS)}" required>
+Instrument: <select id="instrument">{instruments}</select>
+Tuning: <input id="tuning" placeholder="G3 D4 A4 E5" size="12">
+Fingering: <select id="fingering">{fingerings}</select>
+Parts: <input id="parts" value="all" size="10">
+<select id="format"><option>html</option><option>json</option></select>
+<button>Convert</button>
+</form>
+<p id="status"></p>
+<iframe id="result"></iframe>
+<script>
+document.getElementById('form').onsubmit = async function (event) {{
+    event.preventDefault();
+    const file = document.getElementById('file').files[0];
+    const query = new URLSearchParams({{filename: file.name}});
+    for (const name of ['instrument', 'tuning', 'fingering', 'parts', 'format']) {{
+        query.set(name, document.getElementById(name).value);
+    }}
+    const status = document.getElementById('status');
+    status.textContent = 'Converting...';
+    const start = performance.now();
+    const response = await fetch('/convert?' + query, {{method: 'POST', body: file}});
+    const text = await response.text();
+    const result = document.getElementById('result');
+    if (response.headers.get('Content-Type').startsWith('text/html')) {{
+        result.srcdoc = text;
+    }} else {{
+        result.srcdoc = '<pre></pre>';
+        result.onload = function () {{ result.contentDocument.querySelector('pre').textContent = text; }};
+    }}
+    status.textContent = response.status + ' in ' + Math.round(performance.now() - start) + ' ms'
+                         + (response.headers.get('X-Cache') ? ' (cache: ' + response.headers.get('X-Cache') + ')' : '');
+}};
+</script>
+</body>
+</html>
+'''
+
+# Function to serve conversions on localhost until interrupted
+def serve(port=DEFAULT_PORT, jobs=None, max_queue=DEFAULT_MAX_QUEUE, cache_bytes=DEFAULT_CACHE_BYTES):
+    service = ConversionService(jobs, max_queue, cache_bytes)
+    server = ThreadingHTTPServer((HOST, port), ConversionHandler)
+    server.service = service
+    print(f"Converting on http://{HOST}:{server.server_address[1]}/ with {service.jobs} workers (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the fingering conversion of uploaded scores on localhost")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port on 127.0.0.1 (default: {DEFAULT_PORT})")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: number of cores)")
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f"Uploads waiting for a worker before the next ones are refused (default: {DEFAULT_MAX_QUEUE})")
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_BYTES // 2**20,
+                        help=f"Memory for the cached answers in MB (default: {DEFAULT_CACHE_BYTES // 2**20})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    return serve(args.port, args.jobs, args.max_queue, args.cache_mb * 2**20)
+
+if __name__ == "__main__":
+    sys.exit(main())